@@ -1,9 +1,12 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Form, File, UploadFile, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError, DuplicateKeyError
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
@@ -13,8 +16,26 @@ from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
+from abc import ABC, abstractmethod
 import base64
 import hashlib
+import hmac
+import secrets
+import time
+import json
+import orjson
+import re
+import binascii
+import tempfile
+import asyncio
+import multiprocessing
+import bisect
+import heapq
+import itertools
+import math
+from collections import Counter, OrderedDict
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -34,8 +55,33 @@ api_router = APIRouter(prefix="/api")
 SECRET_KEY = "infotech_ma_secret_key_2025"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 30))
+# Window during which a just rotated refresh token still gets its successor back (tabs refreshing together)
+REFRESH_TOKEN_REUSE_GRACE_SECONDS = float(os.environ.get('REFRESH_TOKEN_REUSE_GRACE_SECONDS', 10))
+
+# Abandoned carts: expire CART_RETENTION_DAYS after the last change, empty ones after EMPTY_CART_RETENTION_HOURS
+CART_RETENTION_DAYS = float(os.environ.get('CART_RETENTION_DAYS', 60))
+EMPTY_CART_RETENTION_HOURS = float(os.environ.get('EMPTY_CART_RETENTION_HOURS', 24))
+CART_PURGE_INTERVAL_SECONDS = float(os.environ.get('CART_PURGE_INTERVAL_SECONDS', 3600))
 ADMIN_PASSWORD = "NEW"
 
+# Product images: content-addressed store on local disk (IMAGE_STORE_DIR/<hash[:2]>/<sha256>)
+IMAGE_STORE_DIR = Path(os.environ.get('IMAGE_STORE_DIR', ROOT_DIR / 'images'))
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+# Whole multipart request: the image plus its form framing
+MAX_IMAGE_REQUEST_BYTES = MAX_IMAGE_BYTES + 64 * 1024
+IMAGE_CHUNK_SIZE = 256 * 1024
+
+# Thumbnails: size name -> max edge in pixels, rendered in a process pool next to the original
+THUMBNAIL_SIZES = {"small": 160, "medium": 400, "large": 800}
+THUMBNAIL_FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+
+# Password hashing: bcrypt runs in a dedicated thread pool (it releases the GIL), at most
+# PASSWORD_HASH_WORKERS at a time; beyond PASSWORD_HASH_QUEUE_SIZE waiting calls we answer 503
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 64))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
@@ -47,6 +93,14 @@ class User(BaseModel):
     password_hash: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_admin: bool = False
+    token_version: int = 0  # bumped to revoke every token issued so far
+
+class CurrentUser(BaseModel):
+    # Projection of User resolved for authenticated requests (never carries the password hash)
+    id: str
+    email: str
+    username: str
+    is_admin: bool = False
 
 class UserCreate(BaseModel):
     email: str
@@ -60,6 +114,9 @@ class UserLogin(BaseModel):
 class AdminLogin(BaseModel):
     password: str
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class Product(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -67,11 +124,17 @@ class Product(BaseModel):
     brand: str
     price: float
     description: str
-    image_base64: str
+    image_base64: str = ""  # Legacy inline image, externalised to the image store on write
+    image_hash: Optional[str] = None  # sha256 of the image in the image store
+    image_url: Optional[str] = None  # /api/images/{image_hash}
     stock_quantity: int
     stock_status: str  # "in_stock", "out_of_stock", "coming_soon"
     specifications: Dict[str, Any]
     compatibility_requirements: Dict[str, Any] = {}
+    # Rating aggregates, maintained atomically by create_review/delete_review
+    average_rating: float = 0
+    total_reviews: int = 0
+    rating_distribution: Dict[str, int] = Field(default_factory=lambda: {str(rating): 0 for rating in range(1, 6)})
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ProductCreate(BaseModel):
@@ -86,6 +149,23 @@ class ProductCreate(BaseModel):
     specifications: Dict[str, Any] = {}
     compatibility_requirements: Dict[str, Any] = {}
 
+# Lean projection used by listing views (catalog grid, configurator pickers)
+class ProductCard(BaseModel):
+    id: str
+    name: str
+    category: str
+    brand: str
+    price: float
+    image_url: Optional[str] = None
+    stock_quantity: int
+    stock_status: str
+    average_rating: float = 0
+    total_reviews: int = 0
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str]
+    fields: Optional[str] = None
+
 class CartItem(BaseModel):
     product_id: str
     quantity: int
@@ -97,8 +177,20 @@ class Cart(BaseModel):
     items: List[CartItem] = []
     total: float = 0.0
     promo_code: Optional[str] = None
+    discount_percentage: float = 0.0  # snapshot of the applied promo, so discount is recomputed server-side
     discount: float = 0.0
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# GET /cart?expand=products: each line joined with the current product card
+class ExpandedCartItem(CartItem):
+    product: Optional[ProductCard] = None  # None when the product no longer exists
+    current_price: Optional[float] = None
+    price_changed: bool = False  # price moved since the item was added
+
+class ExpandedCart(Cart):
+    items: List[ExpandedCartItem] = []
+    has_price_changes: bool = False
 
 class PromoCode(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -155,6 +247,7 @@ class ProductReview(BaseModel):
     product_id: str
     rating: int = Field(..., ge=1, le=5)  # 1-5 stars
     comment: Optional[str] = None
+    username: Optional[str] = None  # snapshot taken at write time
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ProductReviewCreate(BaseModel):
@@ -162,6 +255,214 @@ class ProductReviewCreate(BaseModel):
     rating: int = Field(..., ge=1, le=5)
     comment: Optional[str] = None
 
+# Database indexes
+# Declarative registry: collection -> list of (keys, options). Applied idempotently
+# at startup by ensure_indexes(); create_index is a no-op when the index already exists.
+INDEX_REGISTRY: Dict[str, List[tuple]] = {
+    "users": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("token_version", ASCENDING)], {}),
+    ],
+    "refresh_tokens": [
+        ([("token_hash", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING)], {}),
+        ([("family_id", ASCENDING)], {}),
+        # TTL: MongoDB deletes each token once its expires_at has passed
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "products": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Keyset pagination: (sort field, id), optionally prefixed by the category filter
+        ([("category", ASCENDING), ("price", ASCENDING), ("id", ASCENDING)], {}),
+        ([("category", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        ([("price", ASCENDING), ("id", ASCENDING)], {}),
+        ([("created_at", ASCENDING), ("id", ASCENDING)], {}),
+        ([("name", ASCENDING), ("id", ASCENDING)], {}),
+        ([("brand", ASCENDING)], {}),
+        ([("stock_status", ASCENDING)], {}),
+    ],
+    "carts": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING)], {"unique": True}),
+        ([("promo_code", ASCENDING)], {}),
+        # Not a TTL index: purge_expired_carts does the deleting so it can count it.
+        # expires_at is pushed forward by every cart mutation (see cart_activity_stage)
+        ([("expires_at", ASCENDING)], {}),
+    ],
+    "promo_codes": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("code", ASCENDING), ("active", ASCENDING)], {}),
+    ],
+    "product_filters": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("active", ASCENDING)], {}),
+    ],
+    "pc_configurations": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+    "support_tickets": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("created_at", DESCENDING)], {}),
+    ],
+    "product_reviews": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # One compound index per review sort mode (see REVIEW_SORTS)
+        ([("product_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("product_id", ASCENDING), ("rating", DESCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("product_id", ASCENDING), ("rating", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("product_id", ASCENDING), ("user_id", ASCENDING)], {"unique": True}),
+    ],
+}
+
+# Result of the last ensure_indexes() run, exposed via /api/admin/indexes
+index_bootstrap_report: List[Dict[str, Any]] = []
+
+def index_name(keys):
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+async def ensure_indexes():
+    report = []
+    total_start = time.perf_counter()
+    for collection_name, indexes in INDEX_REGISTRY.items():
+        existing_indexes = None
+        for keys, options in indexes:
+            name = index_name(keys)
+            start = time.perf_counter()
+            entry = {"collection": collection_name, "name": name, "keys": keys, "options": options}
+            try:
+                if existing_indexes is None:
+                    existing_indexes = await db[collection_name].index_information()
+                if "expireAfterSeconds" in existing_indexes.get(name, {}) and "expireAfterSeconds" not in options:
+                    # TTL dropped from the registry: same name, other options, create_index would conflict
+                    await db[collection_name].drop_index(name)
+                    logger.info(f"Dropped TTL index {collection_name}.{name}")
+                await db[collection_name].create_index(keys, name=name, **options)
+                entry["status"] = "ok"
+            except PyMongoError as e:
+                # Typically duplicate data blocking a unique index: keep serving, report it
+                entry["status"] = "error"
+                entry["error"] = str(e)
+                logger.warning(f"Index {collection_name}.{name} could not be created: {e}")
+            entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            report.append(entry)
+    index_bootstrap_report[:] = report
+    logger.info(
+        f"Ensured {len(report)} indexes in {round((time.perf_counter() - total_start) * 1000, 2)} ms "
+        f"({sum(1 for entry in report if entry['status'] == 'error')} errors)"
+    )
+    return report
+
+# Rating aggregates
+def rating_aggregate_update(rating: int, delta: int) -> List[dict]:
+    # Single-document pipeline update: counters and average change in one atomic write,
+    # so concurrent reviews can never leave an average computed from stale counters
+    distribution = {
+        str(star): {"$add": [{"$ifNull": [f"$rating_distribution.{star}", 0]}, delta if star == rating else 0]}
+        for star in range(1, 6)
+    }
+    return [
+        {"$set": {
+            "rating_sum": {"$add": [{"$ifNull": ["$rating_sum", 0]}, rating * delta]},
+            "total_reviews": {"$add": [{"$ifNull": ["$total_reviews", 0]}, delta]},
+            "rating_distribution": distribution,
+        }},
+        {"$set": {
+            "average_rating": {"$cond": [
+                {"$gt": ["$total_reviews", 0]},
+                {"$round": [{"$divide": ["$rating_sum", "$total_reviews"]}, 1]},
+                0
+            ]},
+        }},
+    ]
+
+def empty_review_stats() -> dict:
+    return {"average_rating": 0, "total_reviews": 0, "rating_distribution": {star: 0 for star in range(1, 6)}, "rating_sum": 0}
+
+async def aggregate_review_stats(product_ids: Optional[List[str]] = None) -> Dict[str, dict]:
+    # One $match (served by the product_id index) + $group over db.product_reviews,
+    # counted server-side whatever the number of reviews per product
+    match = {"product_id": {"$in": product_ids}} if product_ids is not None else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$product_id",
+            "rating_sum": {"$sum": "$rating"},
+            "total_reviews": {"$sum": 1},
+            **{f"r{star}": {"$sum": {"$cond": [{"$eq": ["$rating", star]}, 1, 0]}} for star in range(1, 6)},
+        }},
+    ]
+    stats = {}
+    async for entry in db.product_reviews.aggregate(pipeline):
+        stats[entry["_id"]] = {
+            "average_rating": round(entry["rating_sum"] / entry["total_reviews"], 1),
+            "total_reviews": entry["total_reviews"],
+            "rating_distribution": {star: entry[f"r{star}"] for star in range(1, 6)},
+            "rating_sum": entry["rating_sum"],
+        }
+    return stats
+
+def public_review_stats(stats: dict) -> dict:
+    return {key: value for key, value in stats.items() if key != "rating_sum"}
+
+async def recompute_product_ratings(product_ids: Optional[List[str]] = None) -> int:
+    # Rebuild the aggregates from db.product_reviews (backfill / repair)
+    stats = await aggregate_review_stats(product_ids)
+    
+    if product_ids is None:
+        product_ids = await db.products.distinct("id")
+    operations = []
+    for product_id in product_ids:
+        entry = stats.get(product_id) or empty_review_stats()
+        operations.append(UpdateOne({"id": product_id}, {"$set": {
+            "rating_sum": entry["rating_sum"],
+            "total_reviews": entry["total_reviews"],
+            "rating_distribution": {str(star): count for star, count in entry["rating_distribution"].items()},
+            "average_rating": entry["average_rating"],
+        }}))
+    if operations:
+        await db.products.bulk_write(operations, ordered=False)
+    return len(operations)
+
+# Review authors
+DELETED_USER_NAME = "Utilisateur supprimé"
+USERNAME_CACHE_SIZE = int(os.environ.get('USERNAME_CACHE_SIZE', '10000'))
+
+class UsernameCache:
+    """Bounded LRU of user_id -> username for reviews written before usernames were snapshotted.
+    
+    Misses are resolved together with one $in query; unknown ids are not cached.
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+    
+    def put(self, user_id: str, username: str):
+        self.entries[user_id] = username
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+    
+    async def resolve(self, user_ids: List[str]) -> Dict[str, str]:
+        names = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            if user_id in self.entries:
+                self.entries.move_to_end(user_id)
+                names[user_id] = self.entries[user_id]
+            else:
+                missing.append(user_id)
+        if missing:
+            async for user in db.users.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "username": 1}):
+                names[user["id"]] = user["username"]
+                self.put(user["id"], user["username"])
+        return names
+
+username_cache = UsernameCache(USERNAME_CACHE_SIZE)
+
 # Authentication functions
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -169,6 +470,81 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """Runs bcrypt off the event loop with bounded concurrency and a bounded wait queue."""
+    
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+    
+    async def run(self, function, *args):
+        if self.waiting >= self.queue_size:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+        
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        
+        started_at = time.perf_counter()
+        waited = started_at - queued_at
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.running -= 1
+            self.slots.release()
+            self.completed += 1
+            self.run_seconds += time.perf_counter() - started_at
+    
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+    
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / self.completed * 1000, 2) if self.completed else 0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+            "avg_run_ms": round(self.run_seconds / self.completed * 1000, 2) if self.completed else 0,
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE)
+
+def user_claims(user: dict) -> dict:
+    # Everything get_current_user needs travels in the token, so authorizing a request needs no lookup
+    return {
+        "sub": user["id"],
+        "username": user["username"],
+        "email": user["email"],
+        "is_admin": user.get("is_admin", False),
+        "tv": user.get("token_version", 0),
+    }
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -176,20 +552,177 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# Authenticated users: projected records cached by id so protected routes skip the users lookup
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+CURRENT_USER_PROJECTION = {"_id": 0, "id": 1, "email": 1, "username": 1, "is_admin": 1}
+
+class UserCache:
+    """Bounded TTL + LRU cache of CurrentUser records keyed by user id.
+    
+    Writes to a user in this worker call invalidate(); other workers converge after the TTL.
+    Unknown ids are not cached, so a freshly registered user is never shadowed.
+    """
+    
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    async def get(self, user_id: str) -> Optional[CurrentUser]:
+        entry = self.entries.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl_seconds:
+            self.hits += 1
+            self.entries.move_to_end(user_id)
+            return entry[0]
+        
+        self.misses += 1
+        document = await db.users.find_one({"id": user_id}, CURRENT_USER_PROJECTION)
+        if document is None:
+            self.entries.pop(user_id, None)
+            return None
+        user = CurrentUser(**document)
+        self.entries[user_id] = (user, time.monotonic())
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return user
+    
+    def invalidate(self, user_id: str):
+        self.entries.pop(user_id, None)
+    
+    def clear(self):
+        self.entries.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+        }
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_SIZE)
+
+def invalidate_user(user_id: str):
+    # Call after any write to a users document (profile, role, deletion)
+    user_cache.invalidate(user_id)
+    username_cache.entries.pop(user_id, None)
+
+# Token revocation: user id -> minimum valid token version, only for users that were ever revoked
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', 30))
+
+class TokenRevocations:
+    """In-memory map of revoked token versions, reloaded from db.users every refresh period.
+    
+    Revocations made in this worker apply immediately; other workers converge after the refresh.
+    """
+    
+    def __init__(self):
+        self.min_versions: Dict[str, int] = {}
+        self.loaded_at: Optional[datetime] = None
+    
+    async def refresh(self):
+        min_versions = {}
+        async for user in db.users.find({"token_version": {"$gt": 0}}, {"_id": 0, "id": 1, "token_version": 1}):
+            min_versions[user["id"]] = user["token_version"]
+        self.min_versions = min_versions
+        self.loaded_at = datetime.utcnow()
+    
+    def is_revoked(self, user_id: str, token_version: int) -> bool:
+        return token_version < self.min_versions.get(user_id, 0)
+    
+    def revoke(self, user_id: str, token_version: int):
+        self.min_versions[user_id] = max(token_version, self.min_versions.get(user_id, 0))
+
+token_revocations = TokenRevocations()
+
+async def refresh_token_revocations_periodically():
+    while True:
+        await asyncio.sleep(TOKEN_REVOCATION_REFRESH_SECONDS)
+        try:
+            await token_revocations.refresh()
+        except PyMongoError as e:
+            logger.warning(f"Token revocation refresh failed: {e}")
+
+async def revoke_user_tokens(user_id: str) -> Optional[int]:
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"token_version": 1}},
+        projection={"_id": 0, "token_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        return None
+    token_revocations.revoke(user_id, user["token_version"])
+    await db.refresh_tokens.delete_many({"user_id": user_id})
+    invalidate_user(user_id)
+    return user["token_version"]
+
+# Refresh tokens: opaque random strings, stored only as a SHA-256 hash and rotated on every use.
+# All tokens descending from one login share a family_id; presenting an already rotated token
+# means it leaked, so the whole family is revoked, unless it was rotated less than
+# REFRESH_TOKEN_REUSE_GRACE_SECONDS ago: browser tabs share the token and may refresh together.
+def hash_refresh_token(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def successor_refresh_token(refresh_token: str) -> str:
+    # Derived rather than random so a grace-window retry can be answered with the same successor
+    # without ever storing a token in clear
+    digest = hmac.new(SECRET_KEY.encode(), f"refresh:{refresh_token}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+async def issue_refresh_token(user: dict, family_id: Optional[str] = None, refresh_token: Optional[str] = None) -> str:
+    refresh_token = refresh_token or secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    await db.refresh_tokens.insert_one({
+        "token_hash": hash_refresh_token(refresh_token),
+        "user_id": user["id"],
+        "family_id": family_id or str(uuid.uuid4()),
+        "token_version": user.get("token_version", 0),
+        "created_at": now,
+        "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        "rotated_at": None,
+    })
+    return refresh_token
+
+async def token_response(user: dict) -> dict:
+    return {
+        "access_token": create_access_token(data=user_claims(user)),
+        "refresh_token": await issue_refresh_token(user),
+        "token_type": "bearer",
+    }
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> CurrentUser:
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id})
+        if token_revocations.is_revoked(user_id, payload.get("tv", 0)):
+            raise HTTPException(status_code=401, detail="Token revoked")
+        
+        # Fast path: the signed claims are enough, no database access
+        if "username" in payload and "email" in payload:
+            return CurrentUser(id=user_id, email=payload["email"], username=payload["username"], is_admin=payload.get("is_admin", False))
+        
+        # Tokens issued before claims were embedded
+        user = await user_cache.get(user_id)
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def get_admin_user(user: User = Depends(get_current_user)):
+async def get_admin_user(user: CurrentUser = Depends(get_current_user)):
     if not user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
@@ -246,6 +779,234 @@ async def validate_pc_configuration(components):
     
     return len(issues) == 0, issues
 
+# Image store functions
+IMAGE_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"GIF87a") or head.startswith(b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def image_path(image_hash: str) -> Path:
+    return IMAGE_STORE_DIR / image_hash[:2] / image_hash
+
+def image_url(image_hash: str) -> str:
+    return f"/api/images/{image_hash}"
+
+def commit_image_file(tmp_path: str, image_hash: str):
+    # Same content -> same path: an existing file is already the right bytes
+    target = image_path(image_hash)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.exists():
+        os.unlink(tmp_path)
+    else:
+        os.replace(tmp_path, target)
+
+def store_image_bytes(data: bytes) -> str:
+    if len(data) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail="Image too large")
+    if sniff_image_type(data[:16]) is None:
+        raise HTTPException(status_code=415, detail="Unsupported image format")
+    image_hash = hashlib.sha256(data).hexdigest()
+    if not image_path(image_hash).exists():
+        IMAGE_STORE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=IMAGE_STORE_DIR, prefix=".upload-")
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        commit_image_file(tmp_path, image_hash)
+    return image_hash
+
+async def store_image_upload(file: UploadFile) -> str:
+    # Copy the spooled upload in chunks: hash and write to a temp file, never hold the whole image in memory
+    IMAGE_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=IMAGE_STORE_DIR, prefix=".upload-")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(IMAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and sniff_image_type(chunk[:16]) is None:
+                    raise HTTPException(status_code=415, detail="Unsupported image format")
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    raise HTTPException(status_code=413, detail="Image too large")
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty image")
+        image_hash = digest.hexdigest()
+        await run_in_threadpool(commit_image_file, tmp_path, image_hash)
+        schedule_derivatives(image_hash)
+        return image_hash
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+IMAGE_UPLOAD_PATH = re.compile(r"^/api/admin/products/[^/]+/image$")
+
+class ImageUploadLimitMiddleware:
+    """Rejects oversized image uploads before Starlette spools the multipart body to disk.
+    
+    Checks Content-Length up front, and counts the received bytes for chunked requests.
+    """
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not IMAGE_UPLOAD_PATH.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse({"detail": "Image too large"}, status_code=413)(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised while the form is parsed; FastAPI re-raises HTTPException as is
+                    raise HTTPException(status_code=413, detail="Image too large")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+async def store_image_base64(image_base64: str) -> str:
+    try:
+        data = base64.b64decode(image_base64, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    image_hash = await run_in_threadpool(store_image_bytes, data)
+    schedule_derivatives(image_hash)
+    return image_hash
+
+def derivative_path(image_hash: str, size: str, fmt: str) -> Path:
+    return image_path(image_hash).with_name(f"{image_hash}_{size}.{fmt}")
+
+def render_derivatives(image_hash: str) -> List[str]:
+    # Runs in a worker process: CPU-bound decoding/resizing never touches the event loop
+    from PIL import Image
+    
+    rendered = []
+    with Image.open(image_path(image_hash)) as original:
+        original.load()
+        for size, max_edge in THUMBNAIL_SIZES.items():
+            thumbnail = original.copy()
+            thumbnail.thumbnail((max_edge, max_edge))
+            for fmt in THUMBNAIL_FORMATS:
+                target = derivative_path(image_hash, size, fmt)
+                if target.exists():
+                    continue
+                image = thumbnail
+                if fmt == "jpeg" and image.mode != "RGB":
+                    # JPEG has no alpha channel: flatten onto white
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    rgba = image.convert("RGBA")
+                    background.paste(rgba, mask=rgba.split()[-1])
+                    image = background
+                elif fmt == "webp" and image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+                tmp_path = target.with_name(f".{target.name}.{os.getpid()}")
+                image.save(tmp_path, format=fmt.upper(), quality=82)
+                os.replace(tmp_path, target)
+                rendered.append(target.name)
+    return rendered
+
+thumbnail_executor: Optional[ProcessPoolExecutor] = None
+pending_derivatives: set = set()
+# Images Pillow could not render (corrupt or undecodable): served as originals, never re-queued
+# by GET /images; POST /admin/images/derivatives retries them
+failed_derivatives: set = set()
+
+def get_thumbnail_executor() -> ProcessPoolExecutor:
+    global thumbnail_executor
+    if thumbnail_executor is None:
+        # Not fork: this process already runs Motor and bcrypt threads
+        thumbnail_executor = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver")
+        )
+    return thumbnail_executor
+
+def discard_thumbnail_executor(executor: ProcessPoolExecutor):
+    # A dead worker (OOM, decoder crash) breaks the pool for good: drop it, the next call builds a new one
+    global thumbnail_executor
+    if thumbnail_executor is executor:
+        thumbnail_executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("Thumbnail process pool was broken, it will be recreated")
+
+def schedule_derivatives(image_hash: str, retry_failed: bool = False):
+    # Fire and forget: the original is served until the thumbnails exist
+    if image_hash in pending_derivatives:
+        return
+    if image_hash in failed_derivatives:
+        if not retry_failed:
+            return
+        failed_derivatives.discard(image_hash)
+    executor = get_thumbnail_executor()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(executor, render_derivatives, image_hash)
+    except BrokenExecutor as e:
+        # Never fail the request over a thumbnail: the next upload or GET /images reschedules it
+        logger.warning(f"Could not schedule thumbnails for image {image_hash}: {e}")
+        discard_thumbnail_executor(executor)
+        return
+    except RuntimeError as e:
+        logger.warning(f"Could not schedule thumbnails for image {image_hash}: {e}")
+        return
+    pending_derivatives.add(image_hash)
+    
+    def on_done(done):
+        pending_derivatives.discard(image_hash)
+        if done.cancelled():
+            return
+        error = done.exception()
+        if error is not None:
+            logger.warning(f"Thumbnail generation failed for image {image_hash}: {error}")
+            if isinstance(error, BrokenExecutor):
+                # A broken pool says nothing about the image itself
+                discard_thumbnail_executor(executor)
+            else:
+                failed_derivatives.add(image_hash)
+    
+    future.add_done_callback(on_done)
+
+def image_fields(image_hash: str) -> dict:
+    return {"image_hash": image_hash, "image_url": image_url(image_hash), "image_base64": ""}
+
+async def migrate_base64_images():
+    # Move inline base64 blobs out of db.products into the image store
+    migrated, failed = 0, []
+    cursor = db.products.find({"image_base64": {"$nin": ["", None]}}, {"_id": 0, "id": 1, "image_base64": 1})
+    async for product in cursor:
+        try:
+            image_hash = await store_image_base64(product["image_base64"])
+        except HTTPException as e:
+            failed.append({"product_id": product["id"], "error": e.detail})
+            continue
+        await db.products.update_one({"id": product["id"]}, {"$set": image_fields(image_hash)})
+        migrated += 1
+    logger.info(f"Migrated {migrated} product images to the image store ({len(failed)} failed)")
+    return {"migrated": migrated, "failed": failed}
+
 # Routes
 @api_router.post("/register")
 async def register(user_data: UserCreate):
@@ -258,23 +1019,27 @@ async def register(user_data: UserCreate):
     user = User(
         email=user_data.email,
         username=user_data.username,
-        password_hash=get_password_hash(user_data.password)
+        password_hash=await password_hasher.hash(user_data.password)
     )
     
-    await db.users.insert_one(user.dict())
+    try:
+        await db.users.insert_one(user.dict())
+    except DuplicateKeyError:
+        # Concurrent registration with the same email: the unique email index rejected this one
+        raise HTTPException(status_code=400, detail="Email already registered")
     
-    # Create access token
-    access_token = create_access_token(data={"sub": user.id})
-    return {"access_token": access_token, "token_type": "bearer", "user": {"id": user.id, "username": user.username, "email": user.email}}
+    # Create access and refresh tokens
+    tokens = await token_response(user.dict())
+    return {**tokens, "user": {"id": user.id, "username": user.username, "email": user.email}}
 
 @api_router.post("/login")
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    if not user or not await password_hasher.verify(user_data.password, user["password_hash"]):
         raise HTTPException(status_code=400, detail="Invalid credentials")
     
-    access_token = create_access_token(data={"sub": user["id"]})
-    return {"access_token": access_token, "token_type": "bearer", "user": {"id": user["id"], "username": user["username"], "email": user["email"]}}
+    tokens = await token_response(user)
+    return {**tokens, "user": {"id": user["id"], "username": user["username"], "email": user["email"]}}
 
 @api_router.post("/admin/login")
 async def admin_login(admin_data: AdminLogin):
@@ -287,81 +1052,933 @@ async def admin_login(admin_data: AdminLogin):
         admin = User(
             email="admin@infotech.ma",
             username="admin",
-            password_hash=get_password_hash(ADMIN_PASSWORD),
+            password_hash=await password_hasher.hash(ADMIN_PASSWORD),
             is_admin=True
         )
-        await db.users.insert_one(admin.dict())
-        admin_user = admin.dict()
+        try:
+            await db.users.insert_one(admin.dict())
+            admin_user = admin.dict()
+        except DuplicateKeyError:
+            # Another admin login created it in the meantime
+            admin_user = await db.users.find_one({"email": "admin@infotech.ma"})
+    
+    tokens = await token_response(admin_user)
+    return {**tokens, "user": {"id": admin_user["id"], "username": "admin", "email": admin_user["email"], "is_admin": True}}
+
+# Renouvellement de session sans mot de passe: une recherche indexée au lieu d'un bcrypt
+@api_router.post("/token/refresh")
+async def refresh_access_token(request_data: RefreshTokenRequest):
+    token_hash = hash_refresh_token(request_data.refresh_token)
+    now = datetime.utcnow()
+    # Atomic claim: of two concurrent refreshes with the same token, only one wins
+    stored = await db.refresh_tokens.find_one_and_update(
+        {"token_hash": token_hash, "rotated_at": None, "expires_at": {"$gt": now}},
+        {"$set": {"rotated_at": now}}
+    )
+    successor = successor_refresh_token(request_data.refresh_token)
+    issued = None
+    if stored is None:
+        reused = await db.refresh_tokens.find_one({"token_hash": token_hash, "rotated_at": {"$ne": None}})
+        if reused is None:
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        if now - reused["rotated_at"] > timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE_SECONDS):
+            logger.warning(f"Refresh token reuse detected for user {reused['user_id']}, revoking its session")
+            await db.refresh_tokens.delete_many({"family_id": reused["family_id"]})
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        # Another tab rotated it a moment ago: answer with the same successor while it is still unused
+        stored = await db.refresh_tokens.find_one({"token_hash": hash_refresh_token(successor), "rotated_at": None, "expires_at": {"$gt": now}})
+        if stored is None:
+            raise HTTPException(status_code=401, detail="Invalid refresh token")
+        issued = successor
+    
+    user = await db.users.find_one({"id": stored["user_id"]}, {"_id": 0, "id": 1, "username": 1, "email": 1, "is_admin": 1, "token_version": 1})
+    if user is None or user.get("token_version", 0) != stored["token_version"]:
+        await db.refresh_tokens.delete_many({"family_id": stored["family_id"]})
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
     
-    access_token = create_access_token(data={"sub": admin_user["id"]})
-    return {"access_token": access_token, "token_type": "bearer", "user": {"id": admin_user["id"], "username": "admin", "email": admin_user["email"], "is_admin": True}}
+    return {
+        "access_token": create_access_token(data=user_claims(user)),
+        "refresh_token": issued or await issue_refresh_token(user, stored["family_id"], successor),
+        "token_type": "bearer",
+    }
 
-@api_router.get("/products")
-async def get_products(request: Request, category: Optional[str] = None, search: Optional[str] = None):
+@api_router.post("/token/revoke")
+async def revoke_refresh_token(request_data: RefreshTokenRequest):
+    # Déconnexion: invalide toute la session issue de ce refresh token
+    stored = await db.refresh_tokens.find_one({"token_hash": hash_refresh_token(request_data.refresh_token)}, {"family_id": 1})
+    if stored is not None:
+        await db.refresh_tokens.delete_many({"family_id": stored["family_id"]})
+    return {"message": "Session terminée"}
+
+# Product search engine
+SEARCH_FIELD_WEIGHTS = {"name": 3.0, "brand": 1.5, "category": 1.0}
+SEARCH_FIELD_BITS = {field: 1 << position for position, field in enumerate(SEARCH_FIELD_WEIGHTS)}
+SEARCH_INDEX_CHECK_SECONDS = float(os.environ.get('SEARCH_INDEX_CHECK_SECONDS', 5))
+SEARCH_TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+FUZZY_MIN_SIMILARITY = float(os.environ.get('FUZZY_MIN_SIMILARITY', 0.45))
+FUZZY_MAX_CANDIDATES = 200
+FUZZY_MAX_POSTINGS_SCANNED = 3000  # product ids counted per query, bounds the latency whatever the catalogue size
+
+def tokenize(text: str) -> List[str]:
+    # Lowercase, strip accents ("Mémoire" -> "memoire"), split on anything non alphanumeric
+    normalized = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return SEARCH_TOKEN_PATTERN.findall(normalized)
+
+class ProductSearchEngine(ABC):
+    """Interface of the product search backends used by get_products."""
+    
+    @abstractmethod
+    def rebuild(self, products: List[dict]):
+        ...
+    
+    @abstractmethod
+    def upsert(self, product: dict):
+        ...
+    
+    @abstractmethod
+    def remove(self, product_id: str):
+        ...
+    
+    @abstractmethod
+    def search(self, query: str, fields: List[str], limit: Optional[int] = None) -> List[str]:
+        """Return matching product ids, best match first."""
+    
+    def fuzzy_search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Typo-tolerant match on product names, used when search() finds nothing."""
+        return []
+
+def trigrams(text: str) -> set:
+    # Padded trigrams of each token, plus those of the tokens glued together
+    # so that "rtx4070ti" and "RTX 4070 Ti" share all their trigrams
+    tokens = tokenize(text)
+    grams = set()
+    for word in tokens + ["".join(tokens)]:
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams if tokens else set()
+
+class TrigramIndex:
+    """Character trigram index of product names for similarity search."""
+    
+    def __init__(self):
+        self.postings: Dict[str, set] = {}  # trigram -> product ids
+        self.documents: Dict[str, set] = {}  # product id -> trigrams
+    
+    def upsert(self, product_id: str, name: str):
+        self.remove(product_id)
+        grams = trigrams(name)
+        self.documents[product_id] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(product_id)
+    
+    def remove(self, product_id: str):
+        for gram in self.documents.pop(product_id, ()):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(product_id)
+                if not posting:
+                    del self.postings[gram]
+    
+    def search(self, query: str, limit: Optional[int] = None) -> List[tuple]:
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+        
+        # Prefix filtering: a name sharing at least `needed` trigrams with the query must contain
+        # one of its len - needed + 1 rarest trigrams, so only those posting lists are scanned
+        needed = max(1, math.ceil(FUZZY_MIN_SIMILARITY * len(query_grams)))
+        by_rarity = sorted(query_grams, key=lambda gram: len(self.postings.get(gram, ())))
+        shared = Counter()
+        budget = FUZZY_MAX_POSTINGS_SCANNED
+        for gram in by_rarity[:len(query_grams) - needed + 1]:
+            posting = self.postings.get(gram, ())
+            if len(posting) > budget:
+                # Common trigrams ("cor", "amd") would mean walking most of the catalogue: stop at the
+                # budget, trading a little recall on very broad queries for a bounded cost
+                if not shared:
+                    shared.update(itertools.islice(posting, budget))
+                break
+            shared.update(posting)
+            budget -= len(posting)
+        candidates = heapq.nlargest(FUZZY_MAX_CANDIDATES, shared, key=shared.get)
+        
+        results = []
+        for product_id in candidates:
+            document_grams = self.documents[product_id]
+            count = len(query_grams & document_grams)
+            # Share of the query found in the name, Jaccard as tie-breaker for tighter matches
+            containment = count / len(query_grams)
+            if containment < FUZZY_MIN_SIMILARITY:
+                continue
+            jaccard = count / (len(query_grams) + len(document_grams) - count)
+            results.append((product_id, containment, jaccard))
+        results.sort(key=lambda result: (-result[1], -result[2]))
+        return [(product_id, round(containment, 3), round(jaccard, 3)) for product_id, containment, jaccard in (results[:limit] if limit else results)]
+
+class InvertedIndexSearchEngine(ProductSearchEngine):
+    """Tokenised inverted index over name/brand/category kept in memory.
+    
+    Every query token must match (as a prefix) a token of one of the searched fields;
+    matches are scored with SEARCH_FIELD_WEIGHTS, exact tokens scoring above prefixes.
+    """
+    
+    def __init__(self):
+        # token -> product id -> bitmask of SEARCH_FIELD_BITS; ints rather than one set per entry
+        # keep the million-entry postings out of the garbage collector's way
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.sorted_tokens: List[str] = []  # for prefix lookups with bisect
+        self.documents: Dict[str, Dict[str, Any]] = {}  # product id -> {name, field tokens}
+        self.trigram_index = TrigramIndex()
+    
+    def rebuild(self, products: List[dict]):
+        self.postings, self.documents = {}, {}
+        self.trigram_index = TrigramIndex()
+        for product in products:
+            self.remove(product["id"])
+            self.add(product)
+        # One sort for the whole catalogue instead of an insort per new token
+        self.sorted_tokens = sorted(self.postings)
+    
+    def upsert(self, product: dict):
+        self.remove(product["id"])
+        for token in self.add(product):
+            bisect.insort(self.sorted_tokens, token)
+    
+    def add(self, product: dict) -> List[str]:
+        # Indexes a product absent from the index, returns the tokens it introduced
+        tokens_by_field = {field: set(tokenize(product.get(field, ""))) for field in SEARCH_FIELD_WEIGHTS}
+        self.documents[product["id"]] = {"name": product.get("name", ""), "tokens": tokens_by_field}
+        self.trigram_index.upsert(product["id"], product.get("name", ""))
+        new_tokens = []
+        for field, tokens in tokens_by_field.items():
+            for token in tokens:
+                if token not in self.postings:
+                    self.postings[token] = {}
+                    new_tokens.append(token)
+                posting = self.postings[token]
+                posting[product["id"]] = posting.get(product["id"], 0) | SEARCH_FIELD_BITS[field]
+        return new_tokens
+    
+    def remove(self, product_id: str):
+        self.trigram_index.remove(product_id)
+        document = self.documents.pop(product_id, None)
+        if document is None:
+            return
+        for tokens in document["tokens"].values():
+            for token in tokens:
+                posting = self.postings.get(token)
+                if posting is None:
+                    continue
+                posting.pop(product_id, None)
+                if not posting:
+                    del self.postings[token]
+                    del self.sorted_tokens[bisect.bisect_left(self.sorted_tokens, token)]
+    
+    def prefix_matches(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        end = bisect.bisect_left(self.sorted_tokens, prefix + "\uffff")
+        return self.sorted_tokens[start:end]
+    
+    def search(self, query: str, fields: List[str], limit: Optional[int] = None) -> List[str]:
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        
+        scores: Optional[Dict[str, float]] = None
+        for query_token in query_tokens:
+            token_scores: Dict[str, float] = {}
+            for token in self.prefix_matches(query_token):
+                exactness = 1.0 if token == query_token else 0.5
+                for product_id, field_bits in self.postings[token].items():
+                    score = max((SEARCH_FIELD_WEIGHTS[field] for field in fields if field_bits & SEARCH_FIELD_BITS[field]), default=0)
+                    if score:
+                        token_scores[product_id] = max(token_scores.get(product_id, 0), score * exactness)
+            # AND semantics: keep only products matching every query token
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {product_id: scores[product_id] + score for product_id, score in token_scores.items() if product_id in scores}
+            if not scores:
+                return []
+        
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], self.documents[product_id]["name"].lower()))
+        return ranked[:limit] if limit else ranked
+    
+    def fuzzy_search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        return [product_id for product_id, _, _ in self.trigram_index.search(query, limit)]
+
+class SuggestIndex:
+    """Sorted array of (normalised key, product id) for search-as-you-type.
+    
+    Keys are the product name starting at each of its words, the brand and the category,
+    so "ryz", "amd ry" and "5900" all reach "AMD Ryzen 9 5900X" with a single bisect.
+    """
+    
+    MAX_SCAN = 500  # bound on entries inspected per query, whatever the prefix length
+    
+    def __init__(self):
+        self.entries: List[tuple] = []
+        self.products: Dict[str, Dict[str, Any]] = {}  # product id -> {id, name, category, keys}
+    
+    def make_record(self, product: dict) -> Dict[str, Any]:
+        tokens = tokenize(product.get("name", ""))
+        keys = {" ".join(tokens[i:]) for i in range(len(tokens))}
+        for field in ("brand", "category"):
+            key = " ".join(tokenize(product.get(field, "")))
+            if key:
+                keys.add(key)
+        return {
+            "id": product["id"],
+            "name": product.get("name", ""),
+            "category": product.get("category", ""),
+            "name_key": " ".join(tokens),
+            "keys": sorted(keys),
+        }
+    
+    def rebuild(self, products: List[dict]):
+        self.products = {product["id"]: self.make_record(product) for product in products}
+        self.entries = sorted((key, product_id) for product_id, record in self.products.items() for key in record["keys"])
+    
+    def upsert(self, product: dict):
+        self.remove(product["id"])
+        record = self.make_record(product)
+        self.products[product["id"]] = record
+        for key in record["keys"]:
+            bisect.insort(self.entries, (key, product["id"]))
+    
+    def remove(self, product_id: str):
+        product = self.products.pop(product_id, None)
+        if product is None:
+            return
+        for key in product["keys"]:
+            position = bisect.bisect_left(self.entries, (key, product_id))
+            if position < len(self.entries) and self.entries[position] == (key, product_id):
+                del self.entries[position]
+    
+    def suggest(self, query: str, limit: int) -> List[Dict[str, str]]:
+        prefix = " ".join(tokenize(query))
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self.entries, (prefix,))
+        end = bisect.bisect_left(self.entries, (prefix + "\uffff",), lo=start)
+        
+        # Products whose name itself starts with the prefix come first, then word/brand/category matches
+        name_matches, other_matches = [], []
+        for key, product_id in self.entries[start:min(end, start + self.MAX_SCAN)]:
+            if key == self.products[product_id]["name_key"]:
+                name_matches.append(product_id)
+            else:
+                other_matches.append(product_id)
+        
+        suggestions, seen = [], set()
+        for product_id in name_matches + other_matches:
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            product = self.products[product_id]
+            suggestions.append({"id": product["id"], "name": product["name"], "category": product["category"]})
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+search_engine: ProductSearchEngine = InvertedIndexSearchEngine()
+suggest_index = SuggestIndex()
+SEARCH_INDEX_PROJECTION = {"_id": 0, "id": 1, **{field: 1 for field in SEARCH_FIELD_WEIGHTS}}
+# "products" catalog version the index was last rebuilt from (see catalog_versions)
+search_index_version: Optional[str] = None
+
+def index_product(product: dict):
+    search_engine.upsert(product)
+    suggest_index.upsert(product)
+
+def unindex_product(product_id: str):
+    search_engine.remove(product_id)
+    suggest_index.remove(product_id)
+
+def build_search_indexes(products: List[dict]) -> tuple:
+    engine = InvertedIndexSearchEngine()
+    engine.rebuild(products)
+    suggestions = SuggestIndex()
+    suggestions.rebuild(products)
+    return engine, suggestions
+
+async def rebuild_search_index():
+    global search_engine, suggest_index, search_index_version
+    start = time.perf_counter()
+    # Read the version before the products: a write landing during the load leaves a mismatch, so another rebuild
+    version = await catalog_versions.get("products")
+    products = await db.products.find({}, SEARCH_INDEX_PROJECTION).to_list(None)
+    # Seconds of CPU on a large catalogue: build fresh indexes off the event loop, then swap them in.
+    # Requests keep using the previous ones meanwhile; an index_product() on those is not carried
+    # over, but its version bump makes the next check rebuild again
+    search_engine, suggest_index = await run_in_threadpool(build_search_indexes, products)
+    search_index_version = version
+    logger.info(f"Search index rebuilt with {len(products)} products in {round((time.perf_counter() - start) * 1000, 2)} ms")
+
+async def refresh_search_index_periodically():
+    # Admin writes update this worker's index immediately; other workers rebuild once they see
+    # the "products" version move, within SEARCH_INDEX_CHECK_SECONDS + CATALOG_VERSION_TTL_SECONDS
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_CHECK_SECONDS)
+        try:
+            if await catalog_versions.get("products") != search_index_version:
+                await rebuild_search_index()
+        except PyMongoError as e:
+            logger.warning(f"Search index refresh failed: {e}")
+
+async def reindex_product(product_id: str):
+    product = await db.products.find_one({"id": product_id}, SEARCH_INDEX_PROJECTION)
+    if product:
+        index_product(product)
+    else:
+        unindex_product(product_id)
+
+def parse_search_fields(search_in: Optional[str]) -> List[str]:
+    if not search_in:
+        # Recherche prioritaire dans le nom du produit (titre) uniquement
+        return ["name"]
+    fields = [field.strip() for field in search_in.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in SEARCH_FIELD_WEIGHTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown search fields: {', '.join(unknown)}")
+    return fields
+
+# Product listing helpers
+PRODUCT_SORT_FIELDS = {"created_at", "price", "name"}
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Fast JSON path for trusted documents
+# Documents read back from our own collections were validated when written: they are
+# wrapped with model_construct (no re-validation) and serialised straight to bytes by orjson,
+# bypassing FastAPI's jsonable_encoder. Mongo's _id is dropped by projection.
+NO_ID = {"_id": 0}
+PASSTHROUGH_HEADERS = ("etag", "cache-control", "vary", "x-search-mode")
+
+def orjson_default(value):
+    if isinstance(value, BaseModel):
+        return value.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dump_json(content) -> bytes:
+    return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+def fast_json(content, response: Optional[Response] = None) -> FastJSONResponse:
+    # Returning a Response bypasses the injected one: carry over the headers set on it
+    headers = None
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key in PASSTHROUGH_HEADERS}
+    return FastJSONResponse(content, headers=headers)
+
+def trusted(model, document: dict):
+    return model.model_construct(**document)
+
+# Streaming (NDJSON) responses for large lists
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 200
+
+def wants_ndjson(request: Request) -> bool:
+    # Opt-in with ?stream=1 or Accept: application/x-ndjson
+    return request.query_params.get("stream") in ("1", "true") or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_line(item) -> bytes:
+    return dump_json(item) + b"\n"
+
+def stream_documents(documents, shape, headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    # `documents` is a Motor cursor (or any async iterator): one line is written per document
+    # as batches arrive, so memory stays bounded by STREAM_BATCH_SIZE whatever the result size
+    async def body():
+        async for document in documents:
+            yield ndjson_line(shape(document))
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+# Catalog versions (ETag / If-None-Match)
+# One opaque version per scope in db.catalog_versions, replaced on every write of that scope.
+# Reads use a copy cached for CATALOG_VERSION_TTL_SECONDS; writes in this worker update it at once.
+CATALOG_VERSION_TTL_SECONDS = float(os.environ.get('CATALOG_VERSION_TTL_SECONDS', 2))
+CATALOG_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+class CatalogVersions:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.versions: Dict[str, str] = {}
+        self.loaded_at = 0.0
+    
+    async def get(self, *scopes: str) -> str:
+        if time.monotonic() - self.loaded_at >= self.ttl_seconds:
+            docs = await db.catalog_versions.find({}).to_list(100)
+            self.versions = {doc["_id"]: doc["version"] for doc in docs}
+            self.loaded_at = time.monotonic()
+        return ":".join(f"{scope}={self.versions.get(scope, '0')}" for scope in scopes)
+    
+    async def bump(self, *scopes: str):
+        for scope in scopes:
+            # A random token rather than a counter: a reset collection can never reuse an old ETag
+            doc = await db.catalog_versions.find_one_and_update(
+                {"_id": scope},
+                {"$set": {"version": uuid.uuid4().hex, "updated_at": datetime.utcnow()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self.versions[scope] = doc["version"]
+
+catalog_versions = CatalogVersions(CATALOG_VERSION_TTL_SECONDS)
+
+async def catalog_etag(request: Request, *scopes: str, local_version: Optional[str] = None) -> str:
+    # Strong ETag: same versions + same path and query parameters -> same body.
+    # local_version: version of in-memory data behind the body (search index) that may still lag
+    # the stored one; the ETag changes again once it catches up instead of pinning a stale body
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.multi_items()))
+    version = await catalog_versions.get(*scopes)
+    if local_version is not None:
+        version = f"{version}|{local_version}"
+    representation = "ndjson" if wants_ndjson(request) else "json"
+    digest = hashlib.sha256(f"{version}|{representation}|{request.url.path}?{query}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # If-None-Match uses weak comparison: W/"x" matches "x"
+    return "*" in candidates or etag in [candidate.removeprefix("W/") for candidate in candidates]
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CATALOG_CACHE_CONTROL})
+
+def set_cache_headers(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CATALOG_CACHE_CONTROL
+    response.headers["Vary"] = "Accept"
+
+# Active product filters cache
+FILTER_CACHE_TTL_SECONDS = float(os.environ.get('FILTER_CACHE_TTL_SECONDS', 30))
+
+def filter_param_name(filter_config: dict) -> str:
+    return f"filter_{filter_config['name'].lower().replace(' ', '_')}"
+
+def make_filter_handler(filter_config: dict):
+    # Returns a function: raw query value -> Mongo criteria (or None to ignore the value)
+    field = filter_config['field']
+    filter_type = filter_config['type']
+    
+    if filter_type == "select":
+        # Pour les filtres de sélection (ex: marque, couleur)
+        def handle_select(filter_value):
+            return {field: filter_value} if filter_value else None
+        return handle_select
+    
+    if filter_type == "range":
+        # Pour les filtres de plage (ex: prix)
+        def handle_range(filter_value):
+            if not filter_value:
+                return None
+            try:
+                if ":" in filter_value:  # Format: "min:max"
+                    min_val, max_val = filter_value.split(":")
+                    range_criteria = {}
+                    if min_val:
+                        range_criteria["$gte"] = float(min_val)
+                    if max_val:
+                        range_criteria["$lte"] = float(max_val)
+                    return {field: range_criteria} if range_criteria else None
+                # Valeur unique
+                return {field: float(filter_value)}
+            except ValueError:
+                return None  # Ignorer les valeurs invalides
+        return handle_range
+    
+    if filter_type == "boolean":
+        def handle_boolean(filter_value):
+            if filter_value.lower() in ['true', 'false']:
+                return {field: filter_value.lower() == 'true'}
+            return None
+        return handle_boolean
+    
+    return None
+
+class ActiveFilterCache:
+    """Active ProductFilter definitions kept in memory, pre-parsed into param name -> handlers.
+    
+    Admin writes in this worker call invalidate(); other workers reload as soon as the "filters"
+    catalog version differs from the one the cache was loaded under, so a body never lags its ETag.
+    The TTL only bounds the age of the cache otherwise.
+    """
+    
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.catalog_version: Optional[str] = None
+        self.filters: Optional[List[ProductFilter]] = None
+        self.handlers: Dict[str, List[Any]] = {}
+        self.loaded_at = 0.0
+        self.lock = asyncio.Lock()
+    
+    def is_fresh(self, catalog_version: str) -> bool:
+        return (
+            self.filters is not None
+            and self.catalog_version == catalog_version
+            and time.monotonic() - self.loaded_at < self.ttl_seconds
+        )
+    
+    async def refresh(self, catalog_version: str):
+        async with self.lock:
+            if self.is_fresh(catalog_version):
+                return self.filters, self.handlers
+            version = self.version
+            docs = await db.product_filters.find({"active": True}).to_list(1000)
+            handlers: Dict[str, List[Any]] = {}
+            for filter_config in docs:
+                handler = make_filter_handler(filter_config)
+                if handler is not None:
+                    handlers.setdefault(filter_param_name(filter_config), []).append(handler)
+            filters = [ProductFilter(**filter_data) for filter_data in docs]
+            # An invalidation that raced with the load wins: serve the result but don't cache it
+            if version == self.version:
+                self.filters = filters
+                self.handlers = handlers
+                self.catalog_version = catalog_version
+                self.loaded_at = time.monotonic()
+            return filters, handlers
+    
+    async def get_filters(self) -> List[ProductFilter]:
+        catalog_version = await catalog_versions.get("filters")
+        if self.is_fresh(catalog_version):
+            return self.filters
+        filters, _ = await self.refresh(catalog_version)
+        return filters
+    
+    async def get_handlers(self) -> Dict[str, List[Any]]:
+        catalog_version = await catalog_versions.get("filters")
+        if self.is_fresh(catalog_version):
+            return self.handlers
+        _, handlers = await self.refresh(catalog_version)
+        return handlers
+    
+    def invalidate(self):
+        self.version += 1
+        self.filters = None
+        self.handlers = {}
+
+active_filter_cache = ActiveFilterCache(FILTER_CACHE_TTL_SECONDS)
+
+async def build_product_filter(request: Request, category: Optional[str]):
     filter_criteria = {}
     
     # Filtres existants
     if category:
         filter_criteria["category"] = category
     
-    if search:
-        # Recherche prioritaire dans le nom du produit (titre) uniquement
-        # Utilisation de regex pour chercher le mot exact ou contenu dans le nom
-        filter_criteria["name"] = {"$regex": search, "$options": "i"}
-    
     # Filtres dynamiques - analyser tous les paramètres de requête
-    query_params = dict(request.query_params)
-    
-    # Récupérer les filtres actifs
-    active_filters = await db.product_filters.find({"active": True}).to_list(1000)
-    
-    for filter_config in active_filters:
-        param_name = f"filter_{filter_config['name'].lower().replace(' ', '_')}"
-        if param_name in query_params:
-            filter_value = query_params[param_name]
-            field = filter_config['field']
-            filter_type = filter_config['type']
-            
-            if filter_type == "select" and filter_value:
-                # Pour les filtres de sélection (ex: marque, couleur)
-                if field.startswith("specifications."):
-                    filter_criteria[field] = filter_value
-                else:
-                    filter_criteria[field] = filter_value
-            
-            elif filter_type == "range" and filter_value:
-                # Pour les filtres de plage (ex: prix)
-                try:
-                    if ":" in filter_value:  # Format: "min:max"
-                        min_val, max_val = filter_value.split(":")
-                        range_criteria = {}
-                        if min_val:
-                            range_criteria["$gte"] = float(min_val)
-                        if max_val:
-                            range_criteria["$lte"] = float(max_val)
-                        if range_criteria:
-                            filter_criteria[field] = range_criteria
-                    else:
-                        # Valeur unique
-                        filter_criteria[field] = float(filter_value)
-                except ValueError:
-                    pass  # Ignorer les valeurs invalides
-            
-            elif filter_type == "boolean" and filter_value.lower() in ['true', 'false']:
-                filter_criteria[field] = filter_value.lower() == 'true'
-    
-    products = await db.products.find(filter_criteria).to_list(1000)
-    return [Product(**product) for product in products]
+    handlers = await active_filter_cache.get_handlers()
+    for param_name, filter_value in request.query_params.items():
+        for handler in handlers.get(param_name, []):
+            criteria = handler(filter_value)
+            if criteria is not None:
+                filter_criteria.update(criteria)
+    
+    return filter_criteria
+
+PRODUCT_FIELD_PRESETS = {
+    "card": list(ProductCard.model_fields),
+}
+
+def parse_product_fields(fields: Optional[str]) -> Optional[List[str]]:
+    # None means the full Product document
+    if not fields or fields == "full":
+        return None
+    if fields in PRODUCT_FIELD_PRESETS:
+        return PRODUCT_FIELD_PRESETS[fields]
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in Product.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown product fields: {', '.join(unknown)}")
+    return ["id"] + [field for field in requested if field != "id"]
+
+def product_projection(field_list: Optional[List[str]], *extra: str) -> dict:
+    # Pushed down to Mongo so unrequested fields (image_base64, specifications...) are never read
+    projection = dict(NO_ID)
+    if field_list is not None:
+        for field in [*field_list, *extra]:
+            projection[field] = 1
+    return projection
+
+def shape_product(product: dict, field_list: Optional[List[str]]):
+    if field_list is None:
+        return trusted(Product, product)
+    if field_list is PRODUCT_FIELD_PRESETS["card"]:
+        return trusted(ProductCard, product)
+    return {field: product[field] for field in field_list if field in product}
+
+async def iterate_ranked_products(ranked_ids: List[str], filter_criteria: dict, field_list: Optional[List[str]]):
+    # Search results in relevance order, hydrated STREAM_BATCH_SIZE ids at a time
+    for start in range(0, len(ranked_ids), STREAM_BATCH_SIZE):
+        batch_ids = ranked_ids[start:start + STREAM_BATCH_SIZE]
+        criteria = {**filter_criteria, "id": {"$in": batch_ids}}
+        found = {product["id"]: product for product in await db.products.find(criteria, product_projection(field_list, "id")).to_list(None)}
+        for product_id in batch_ids:
+            if product_id in found:
+                yield found[product_id]
+
+def apply_search(filter_criteria: dict, response: Response, search: Optional[str], search_in: Optional[str], fuzzy: bool):
+    # Recherche via l'index inversé en mémoire, puis hydratation des ids en une requête $in
+    if not search:
+        return None
+    ranked_ids = search_engine.search(search, parse_search_fields(search_in))
+    if not ranked_ids and fuzzy:
+        # Aucun résultat exact: tolérance aux fautes de frappe ("ryzn 5900", "rtx4070ti")
+        ranked_ids = search_engine.fuzzy_search(search)
+        if ranked_ids:
+            response.headers["X-Search-Mode"] = "fuzzy"
+    filter_criteria["id"] = {"$in": ranked_ids}
+    return ranked_ids
+
+# Facets: price bucket boundaries, the last bucket is open ended
+PRICE_FACET_BOUNDARIES = [0, 100, 250, 500, 1000, 2000]
+FACET_FIELDS = ["category", "brand", "stock_status"]
+
+def criteria_without(filter_criteria: dict, field: str) -> dict:
+    # Each facet ignores its own selection so the UI can still offer the sibling values
+    return {key: value for key, value in filter_criteria.items() if key != field}
+
+def build_facet_pipeline(filter_criteria: dict, active_filters: List[ProductFilter]):
+    facets: Dict[str, List[dict]] = {
+        "total": [{"$match": filter_criteria}, {"$count": "count"}],
+        "price": [
+            {"$match": criteria_without(filter_criteria, "price")},
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_FACET_BOUNDARIES,
+                "default": "over",
+                "output": {"count": {"$sum": 1}},
+            }},
+        ],
+    }
+    # $facet output names cannot contain dots: map "f<n>" back to the product field
+    facet_fields = {}
+    for field in FACET_FIELDS + [product_filter.field for product_filter in active_filters]:
+        if field in facet_fields.values() or field == "price":
+            continue
+        facet_fields[f"f{len(facet_fields)}"] = field
+    
+    range_fields = {product_filter.field for product_filter in active_filters if product_filter.type == "range"}
+    for name, field in facet_fields.items():
+        stages = [{"$match": criteria_without(filter_criteria, field)}]
+        if field in range_fields:
+            stages.append({"$group": {"_id": None, "min": {"$min": f"${field}"}, "max": {"$max": f"${field}"}}})
+        else:
+            stages += [
+                {"$match": {field: {"$exists": True}}},
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+            ]
+        facets[name] = stages
+    
+    # Criteria shared by every facet (the search result set) are applied once, before $facet
+    pipeline = []
+    if "id" in filter_criteria:
+        pipeline.append({"$match": {"id": filter_criteria["id"]}})
+    pipeline.append({"$facet": facets})
+    return pipeline, facet_fields, range_fields
+
+def format_facets(result: dict, facet_fields: Dict[str, str], range_fields: set) -> dict:
+    price_buckets = []
+    for bucket in result["price"]:
+        if bucket["_id"] == "over":
+            price_buckets.append({"min": PRICE_FACET_BOUNDARIES[-1], "max": None, "count": bucket["count"]})
+        else:
+            upper = PRICE_FACET_BOUNDARIES[PRICE_FACET_BOUNDARIES.index(bucket["_id"]) + 1]
+            price_buckets.append({"min": bucket["_id"], "max": upper, "count": bucket["count"]})
+    
+    facets = {"price": price_buckets}
+    for name, field in facet_fields.items():
+        if field in range_fields:
+            bounds = result[name][0] if result[name] else {"min": None, "max": None}
+            facets[field] = {"min": bounds["min"], "max": bounds["max"]}
+        else:
+            facets[field] = [{"value": entry["_id"], "count": entry["count"]} for entry in result[name]]
+    
+    return {"total": result["total"][0]["count"] if result["total"] else 0, "facets": facets}
+
+def encode_cursor(sort: str, last_doc: dict) -> str:
+    field = sort.lstrip("-")
+    value = last_doc.get(field)
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    payload = json.dumps({"s": sort, "v": value, "id": last_doc["id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        value = payload["v"]
+        if isinstance(value, dict) and "$date" in value:
+            value = datetime.fromisoformat(value["$date"])
+        last_id = payload["id"]
+        cursor_sort = payload["s"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    return value, last_id
+
+def keyset_criteria(sort: str, value, last_id: str) -> dict:
+    # Strictly after (value, id) in the (sort field, id) ordering
+    field = sort.lstrip("-")
+    op = "$lt" if sort.startswith("-") else "$gt"
+    return {"$or": [{field: {op: value}}, {field: value, "id": {op: last_id}}]}
+
+async def paginate_products(
+    filter_criteria: dict,
+    sort: str,
+    limit: Optional[int],
+    cursor: Optional[str],
+    field_list: Optional[List[str]]
+):
+    if sort.lstrip("-") not in PRODUCT_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort, expected one of {sorted(PRODUCT_SORT_FIELDS)}")
+    limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    
+    query = filter_criteria
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        after_cursor = keyset_criteria(sort, value, last_id)
+        query = {"$and": [filter_criteria, after_cursor]} if filter_criteria else after_cursor
+    
+    direction = DESCENDING if sort.startswith("-") else ASCENDING
+    # Fetch one extra document to know whether another page exists
+    # The sort key is always projected so the next cursor can be built from the last document
+    projection = product_projection(field_list, "id", sort.lstrip("-"))
+    docs = await db.products.find(query, projection).sort(
+        [(sort.lstrip("-"), direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    
+    return {
+        "items": [shape_product(product, field_list) for product in docs],
+        "next_cursor": encode_cursor(sort, docs[-1]) if has_more else None,
+    }
+
+@api_router.get("/products")
+async def get_products(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = "created_at",
+    fields: Optional[str] = None,
+    search_in: Optional[str] = None,
+    fuzzy: bool = True
+):
+    etag = await catalog_etag(request, "products", "filters", local_version=search_index_version if search else None)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    
+    filter_criteria = await build_product_filter(request, category)
+    ranked_ids = apply_search(filter_criteria, response, search, search_in, fuzzy)
+    
+    # Pagination par curseur (keyset) si demandée, sinon liste complète (comportement historique)
+    if limit is not None or cursor is not None:
+        # Les pages sont destinées à la grille du catalogue: projection "card" par défaut
+        field_list = parse_product_fields(fields or "card")
+        return fast_json(await paginate_products(filter_criteria, sort, limit, cursor, field_list), response)
+    
+    field_list = parse_product_fields(fields)
+    
+    if wants_ndjson(request):
+        headers = {key: value for key, value in response.headers.items() if key in PASSTHROUGH_HEADERS}
+        documents = (
+            iterate_ranked_products(ranked_ids, filter_criteria, field_list) if ranked_ids is not None
+            else db.products.find(filter_criteria, product_projection(field_list)).batch_size(STREAM_BATCH_SIZE)
+        )
+        return stream_documents(documents, lambda product: shape_product(product, field_list), headers)
+    
+    products = await db.products.find(filter_criteria, product_projection(field_list)).to_list(1000)
+    if ranked_ids is not None:
+        rank = {product_id: position for position, product_id in enumerate(ranked_ids)}
+        products.sort(key=lambda product: rank[product["id"]])
+    return fast_json([shape_product(product, field_list) for product in products], response)
+
+# Facettes: comptes par valeur pour la requête courante, en un seul aller-retour $facet
+@api_router.get("/products/facets")
+async def get_product_facets(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    search_in: Optional[str] = None,
+    fuzzy: bool = True
+):
+    etag = await catalog_etag(request, "products", "filters", local_version=search_index_version if search else None)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    
+    filter_criteria = await build_product_filter(request, category)
+    apply_search(filter_criteria, response, search, search_in, fuzzy)
+    
+    active_filters = await active_filter_cache.get_filters()
+    pipeline, facet_fields, range_fields = build_facet_pipeline(filter_criteria, active_filters)
+    results = await db.products.aggregate(pipeline).to_list(1)
+    return fast_json(format_facets(results[0], facet_fields, range_fields), response)
+
+# Lecture groupée: tous les ids résolus en une seule requête $in, dans l'ordre demandé
+MAX_BATCH_IDS = 200
+
+async def get_products_by_ids(ids: List[str], fields: Optional[str]):
+    requested = list(dict.fromkeys(product_id for product_id in ids if product_id))
+    if len(requested) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {MAX_BATCH_IDS})")
+    field_list = parse_product_fields(fields)
+    
+    found = {}
+    if requested:
+        products = await db.products.find({"id": {"$in": requested}}, product_projection(field_list, "id")).to_list(len(requested))
+        found = {product["id"]: product for product in products}
+    
+    return fast_json({
+        "items": [shape_product(found[product_id], field_list) for product_id in requested if product_id in found],
+        "missing": [product_id for product_id in requested if product_id not in found],
+    })
+
+@api_router.get("/products/batch")
+async def get_products_batch(ids: str = "", fields: Optional[str] = None):
+    return await get_products_by_ids(ids.split(","), fields)
+
+@api_router.post("/products/batch")
+async def post_products_batch(batch: ProductBatchRequest):
+    # Variante POST pour les longues listes d'ids (limite de longueur d'URL)
+    return await get_products_by_ids(batch.ids, batch.fields)
+
+# Autocomplétion: servie depuis l'index en mémoire, sans requête Mongo
+@api_router.get("/products/suggest")
+async def suggest_products(q: str = "", limit: int = 8):
+    return suggest_index.suggest(q, min(max(limit, 1), 20))
 
 @api_router.get("/products/{product_id}")
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id})
+async def get_product(product_id: str, request: Request, response: Response):
+    etag = await catalog_etag(request, "products")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    product = await db.products.find_one({"id": product_id}, NO_ID)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return Product(**product)
+    set_cache_headers(response, etag)
+    return fast_json(trusted(Product, product), response)
 
 @api_router.post("/admin/products")
-async def create_product(product_data: ProductCreate, admin: User = Depends(get_admin_user)):
+async def create_product(product_data: ProductCreate, admin: CurrentUser = Depends(get_admin_user)):
     # Use the stock status provided, or default based on quantity if not specified
     stock_status = product_data.stock_status
     if not stock_status:
@@ -373,18 +1990,25 @@ async def create_product(product_data: ProductCreate, admin: User = Depends(get_
         brand=product_data.brand,
         price=product_data.price,
         description=product_data.description,
-        image_base64=product_data.image_base64,
         stock_quantity=product_data.stock_quantity,
         stock_status=stock_status,
         specifications=product_data.specifications,
         compatibility_requirements=product_data.compatibility_requirements
     )
     
+    # Inline images are moved to the image store, only the URL is kept on the product
+    if product_data.image_base64:
+        image_hash = await store_image_base64(product_data.image_base64)
+        for field, value in image_fields(image_hash).items():
+            setattr(product, field, value)
+    
     await db.products.insert_one(product.dict())
+    index_product(product.dict())
+    await catalog_versions.bump("products")
     return product
 
 @api_router.put("/admin/products/{product_id}")
-async def update_product(product_id: str, product_data: ProductCreate, admin: User = Depends(get_admin_user)):
+async def update_product(product_id: str, product_data: ProductCreate, admin: CurrentUser = Depends(get_admin_user)):
     # Use the stock status provided, or default based on quantity if not specified  
     stock_status = product_data.stock_status
     if not stock_status:
@@ -393,6 +2017,11 @@ async def update_product(product_id: str, product_data: ProductCreate, admin: Us
     update_data = product_data.dict()
     update_data["stock_status"] = stock_status
     
+    # An empty image_base64 keeps the current image; a new one is moved to the image store
+    image_base64 = update_data.pop("image_base64")
+    if image_base64:
+        update_data.update(image_fields(await store_image_base64(image_base64)))
+    
     result = await db.products.update_one(
         {"id": product_id},
         {"$set": update_data}
@@ -401,212 +2030,398 @@ async def update_product(product_id: str, product_data: ProductCreate, admin: Us
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    await reindex_product(product_id)
+    await catalog_versions.bump("products")
     return {"message": "Product updated successfully"}
 
 @api_router.delete("/admin/products/{product_id}")
-async def delete_product(product_id: str, admin: User = Depends(get_admin_user)):
+async def delete_product(product_id: str, admin: CurrentUser = Depends(get_admin_user)):
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    unindex_product(product_id)
+    await catalog_versions.bump("products")
     return {"message": "Product deleted successfully"}
 
+# === PRODUCT IMAGES ===
+@api_router.post("/admin/products/{product_id}/image")
+async def upload_product_image(product_id: str, file: UploadFile = File(...), admin: CurrentUser = Depends(get_admin_user)):
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "id": 1})
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    image_hash = await store_image_upload(file)
+    await db.products.update_one({"id": product_id}, {"$set": image_fields(image_hash)})
+    await catalog_versions.bump("products")
+    return {"image_hash": image_hash, "image_url": image_url(image_hash)}
+
+@api_router.get("/images/{image_hash}")
+async def get_image(image_hash: str, request: Request, size: Optional[str] = None, format: Optional[str] = None):
+    if not IMAGE_HASH_PATTERN.match(image_hash):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = image_path(image_hash)
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    # Content-addressed: the URL never changes meaning, so clients may cache forever
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    etag = f'"{image_hash}"'
+    media_type = None
+    
+    if size is not None:
+        if size not in THUMBNAIL_SIZES:
+            raise HTTPException(status_code=400, detail=f"Invalid size, expected one of {list(THUMBNAIL_SIZES)}")
+        if format is None:
+            # Negotiated from Accept unless explicitly requested
+            format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+            headers["Vary"] = "Accept"
+        if format not in THUMBNAIL_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Invalid format, expected one of {list(THUMBNAIL_FORMATS)}")
+        thumbnail = derivative_path(image_hash, size, format)
+        if thumbnail.is_file():
+            path, media_type = thumbnail, THUMBNAIL_FORMATS[format]
+            etag = f'"{image_hash}-{size}.{format}"'
+        else:
+            # Not rendered yet: serve the original briefly cacheable and (re)schedule the thumbnails,
+            # unless rendering already failed for this image
+            schedule_derivatives(image_hash)
+            headers["Cache-Control"] = "public, max-age=60"
+    
+    headers["ETag"] = etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    if media_type is None:
+        with open(path, "rb") as image_file:
+            media_type = sniff_image_type(image_file.read(16)) or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@api_router.post("/admin/images/migrate")
+async def migrate_product_images(admin: CurrentUser = Depends(get_admin_user)):
+    result = await migrate_base64_images()
+    if result["migrated"]:
+        await catalog_versions.bump("products")
+    return result
+
+@api_router.post("/admin/images/derivatives")
+async def regenerate_image_derivatives(admin: CurrentUser = Depends(get_admin_user)):
+    image_hashes = await db.products.distinct("image_hash", {"image_hash": {"$ne": None}})
+    for image_hash in image_hashes:
+        if image_path(image_hash).is_file():
+            schedule_derivatives(image_hash, retry_failed=True)
+    return {"scheduled": len(image_hashes)}
+
+async def get_expanded_cart(user_id: str) -> Optional[dict]:
+    # One round trip: the cart and a lean card of every product in it, joined on the products.id index
+    # (localField/foreignField combined with a sub-pipeline requires MongoDB 5.0+)
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$lookup": {
+            "from": "products",
+            "localField": "items.product_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": product_projection(PRODUCT_FIELD_PRESETS["card"])}],
+            "as": "products",
+        }},
+        {"$project": {"_id": 0}},
+    ]
+    carts = await db.carts.aggregate(pipeline).to_list(1)
+    if not carts:
+        return None
+    
+    cart = carts[0]
+    products = {product["id"]: product for product in cart.pop("products")}
+    items = []
+    for item in cart["items"]:
+        product = products.get(item["product_id"])
+        current_price = product["price"] if product else None
+        items.append(trusted(ExpandedCartItem, {
+            **item,
+            "product": trusted(ProductCard, product) if product else None,
+            "current_price": current_price,
+            "price_changed": current_price is not None and round(current_price - item["price"], 2) != 0,
+        }))
+    cart["items"] = items
+    cart["has_price_changes"] = any(item.price_changed for item in items)
+    return cart
+
+class CartPurgeStats:
+    def __init__(self):
+        self.runs = 0
+        self.purged_total = 0
+        self.last_purged = 0
+        self.last_run_at: Optional[datetime] = None
+
+cart_purge_stats = CartPurgeStats()
+
+async def purge_expired_carts() -> int:
+    # The only place carts expire (no TTL index), so the counts below are every cart deleted.
+    # Legacy carts without expires_at: empty ones go, the others got one at startup (backfill_cart_expiry)
+    now = datetime.utcnow()
+    result = await db.carts.delete_many({"$or": [
+        {"expires_at": {"$lte": now}},
+        {"expires_at": {"$exists": False}, "items": {"$size": 0}, "created_at": {"$lte": now - timedelta(hours=EMPTY_CART_RETENTION_HOURS)}},
+    ]})
+    
+    cart_purge_stats.runs += 1
+    cart_purge_stats.last_purged = result.deleted_count
+    cart_purge_stats.purged_total += result.deleted_count
+    cart_purge_stats.last_run_at = now
+    if result.deleted_count:
+        logger.info(f"Purged {result.deleted_count} expired carts")
+    return result.deleted_count
+
+async def backfill_cart_expiry():
+    # Carts with items written before expires_at existed: created_at says nothing about the
+    # shopper's last activity, so give them a full retention period from now
+    now = datetime.utcnow()
+    result = await db.carts.update_many(
+        {"expires_at": {"$exists": False}, "items.0": {"$exists": True}},
+        {"$set": {"updated_at": now, "expires_at": now + timedelta(days=CART_RETENTION_DAYS)}}
+    )
+    if result.modified_count:
+        logger.info(f"Backfilled expires_at on {result.modified_count} carts")
+
+async def purge_expired_carts_periodically():
+    while True:
+        try:
+            await purge_expired_carts()
+        except PyMongoError as e:
+            logger.warning(f"Cart purge failed: {e}")
+        await asyncio.sleep(CART_PURGE_INTERVAL_SECONDS)
+
 @api_router.get("/cart")
-async def get_cart(user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user.id})
+async def get_cart(expand: Optional[str] = None, user: CurrentUser = Depends(get_current_user)):
+    if expand is not None and expand != "products":
+        raise HTTPException(status_code=400, detail="Invalid expand, expected 'products'")
+    
+    if expand == "products":
+        cart = await get_expanded_cart(user.id)
+        model = ExpandedCart
+    else:
+        cart = await db.carts.find_one({"user_id": user.id}, NO_ID)
+        model = Cart
+    
+    # No cart yet: answer with an empty one without writing it, the first add creates it
     if not cart:
-        cart = Cart(user_id=user.id)
-        await db.carts.insert_one(cart.dict())
-        return cart
-    return Cart(**cart)
+        return fast_json(model(user_id=user.id))
+    return fast_json(trusted(model, cart))
+
+# Cart mutations: one atomic pipeline update per request. The items array is changed and
+# total/discount recomputed from it server-side in the same write, so two tabs editing
+# the same cart can never overwrite each other's changes.
+def cart_totals_stages() -> List[dict]:
+    return [
+        {"$set": {"total": {"$sum": {"$map": {
+            "input": "$items", "as": "item", "in": {"$multiply": ["$$item.quantity", "$$item.price"]}
+        }}}}},
+        {"$set": {"discount": {"$multiply": ["$total", {"$divide": [{"$ifNull": ["$discount_percentage", 0]}, 100]}]}}},
+    ]
+
+def cart_activity_stage() -> dict:
+    # Must come after the items stage: an emptied cart gets the short retention
+    now = datetime.utcnow()
+    return {"$set": {
+        "updated_at": now,
+        "expires_at": {"$cond": [
+            {"$gt": [{"$size": {"$ifNull": ["$items", []]}}, 0]},
+            now + timedelta(days=CART_RETENTION_DAYS),
+            now + timedelta(hours=EMPTY_CART_RETENTION_HOURS)
+        ]},
+    }}
+
+def cart_item_expression(quantity, price="$$item.price") -> dict:
+    return {"product_id": "$$item.product_id", "quantity": quantity, "price": price}
+
+def add_item_pipeline(product_id: str, quantity: int, price: float) -> List[dict]:
+    match_id = {"$literal": product_id}
+    # Positional increment when the product is already in the cart, append otherwise
+    increment = {"$map": {"input": "$items", "as": "item", "in": {"$cond": [
+        {"$eq": ["$$item.product_id", match_id]},
+        cart_item_expression({"$add": ["$$item.quantity", quantity]}),
+        "$$item"
+    ]}}}
+    append = {"$concatArrays": [
+        {"$ifNull": ["$items", []]},
+        [{"product_id": match_id, "quantity": quantity, "price": price}]
+    ]}
+    new_cart = Cart(user_id="")
+    return [
+        {"$set": {
+            # Defaults for a cart created by this upsert
+            "id": {"$ifNull": ["$id", new_cart.id]},
+            "created_at": {"$ifNull": ["$created_at", new_cart.created_at]},
+            "promo_code": {"$ifNull": ["$promo_code", None]},
+            "discount_percentage": {"$ifNull": ["$discount_percentage", 0]},
+            "items": {"$cond": [{"$in": [match_id, {"$ifNull": ["$items.product_id", []]}]}, increment, append]},
+        }},
+        cart_activity_stage(),
+        *cart_totals_stages(),
+    ]
+
+def set_quantity_pipeline(product_id: str, quantity: int) -> List[dict]:
+    return [
+        {"$set": {"items": {"$map": {"input": "$items", "as": "item", "in": {"$cond": [
+            {"$eq": ["$$item.product_id", {"$literal": product_id}]},
+            cart_item_expression(quantity),
+            "$$item"
+        ]}}}}},
+        cart_activity_stage(),
+        *cart_totals_stages(),
+    ]
+
+def remove_item_pipeline(product_id: str) -> List[dict]:
+    return [
+        {"$set": {"items": {"$filter": {
+            "input": "$items", "as": "item", "cond": {"$ne": ["$$item.product_id", {"$literal": product_id}]}
+        }}}},
+        cart_activity_stage(),
+        *cart_totals_stages(),
+    ]
+
+async def sync_carts_with_promo(code: str, promo: Optional[dict]):
+    # Admin changed a promo code: re-price the carts using it, or drop it if it is no longer usable
+    if promo is not None and promo.get("active", True):
+        # $literal: in a pipeline update a code starting with "$" would be read as a field path
+        applied = {"promo_code": {"$literal": promo["code"]}, "discount_percentage": promo["discount_percentage"]}
+    else:
+        applied = {"promo_code": None, "discount_percentage": 0}
+    await db.carts.update_many({"promo_code": code}, [{"$set": applied}, *cart_totals_stages()])
+
+async def cart_not_found_or_item(user_id: str):
+    # Only reached when a conditional update matched nothing
+    if await db.carts.count_documents({"user_id": user_id}, limit=1) == 0:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    raise HTTPException(status_code=404, detail="Item not found in cart")
 
 @api_router.post("/cart/add")
-async def add_to_cart(product_id: str, quantity: int = 1, user: User = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id})
+async def add_to_cart(product_id: str, quantity: int = 1, user: CurrentUser = Depends(get_current_user)):
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "price": 1, "stock_quantity": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
     if product["stock_quantity"] < quantity:
         raise HTTPException(status_code=400, detail="Insufficient stock")
     
-    cart = await db.carts.find_one({"user_id": user.id})
-    if not cart:
-        cart = Cart(user_id=user.id)
-    else:
-        cart = Cart(**cart)
-    
-    # Check if item already in cart
-    item_found = False
-    for item in cart.items:
-        if item.product_id == product_id:
-            item.quantity += quantity
-            item_found = True
-            break
-    
-    if not item_found:
-        cart.items.append(CartItem(
-            product_id=product_id,
-            quantity=quantity,
-            price=product["price"]
-        ))
-    
-    # Calculate total
-    cart.total = sum(item.quantity * item.price for item in cart.items)
-    
-    await db.carts.update_one(
+    cart = await db.carts.find_one_and_update(
         {"user_id": user.id},
-        {"$set": cart.dict()},
-        upsert=True
+        add_item_pipeline(product_id, quantity, product["price"]),
+        projection=NO_ID,
+        upsert=True,
+        return_document=ReturnDocument.AFTER
     )
     
-    return {"message": "Item added to cart"}
+    return fast_json({"message": "Item added to cart", "cart": trusted(Cart, cart)})
 
 @api_router.post("/cart/apply-promo")
-async def apply_promo_code(code: str, user: User = Depends(get_current_user)):
+async def apply_promo_code(code: str, user: CurrentUser = Depends(get_current_user)):
     promo = await db.promo_codes.find_one({"code": code, "active": True})
     if not promo:
         raise HTTPException(status_code=404, detail="Invalid promo code")
     
-    cart = await db.carts.find_one({"user_id": user.id})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    cart_obj = Cart(**cart)
-    cart_obj.promo_code = code
-    cart_obj.discount = cart_obj.total * (promo["discount_percentage"] / 100)
-    
-    await db.carts.update_one(
+    cart = await db.carts.find_one_and_update(
         {"user_id": user.id},
-        {"$set": cart_obj.dict()}
+        [{"$set": {"promo_code": {"$literal": code}, "discount_percentage": promo["discount_percentage"]}}, cart_activity_stage(), *cart_totals_stages()],
+        projection=NO_ID,
+        return_document=ReturnDocument.AFTER
     )
-    
-    return {"message": "Promo code applied", "discount": cart_obj.discount}
-
-@api_router.delete("/cart/remove/{product_id}")
-async def remove_from_cart(product_id: str, user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": user.id})
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    cart_obj = Cart(**cart)
-    
-    # Find and remove the item
-    cart_obj.items = [item for item in cart_obj.items if item.product_id != product_id]
-    
-    # Recalculate total
-    cart_obj.total = sum(item.quantity * item.price for item in cart_obj.items)
-    
-    # Recalculate discount if promo code is applied
-    if cart_obj.promo_code:
-        promo = await db.promo_codes.find_one({"code": cart_obj.promo_code, "active": True})
-        if promo:
-            cart_obj.discount = cart_obj.total * (promo["discount_percentage"] / 100)
-        else:
-            cart_obj.discount = 0
-            cart_obj.promo_code = None
-    
-    await db.carts.update_one(
+    return fast_json({"message": "Promo code applied", "discount": cart["discount"], "cart": trusted(Cart, cart)})
+
+@api_router.delete("/cart/remove/{product_id}")
+async def remove_from_cart(product_id: str, user: CurrentUser = Depends(get_current_user)):
+    cart = await db.carts.find_one_and_update(
         {"user_id": user.id},
-        {"$set": cart_obj.dict()}
+        remove_item_pipeline(product_id),
+        projection=NO_ID,
+        return_document=ReturnDocument.AFTER
     )
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
     
-    return {"message": "Item removed from cart"}
+    return fast_json({"message": "Item removed from cart", "cart": trusted(Cart, cart)})
 
 @api_router.put("/cart/update/{product_id}")
-async def update_cart_quantity(product_id: str, quantity: int, user: User = Depends(get_current_user)):
+async def update_cart_quantity(product_id: str, quantity: int, user: CurrentUser = Depends(get_current_user)):
     if quantity <= 0:
         raise HTTPException(status_code=400, detail="Quantity must be greater than 0")
     
     # Check product availability
-    product = await db.products.find_one({"id": product_id})
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "stock_quantity": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
     if product["stock_quantity"] < quantity:
         raise HTTPException(status_code=400, detail="Insufficient stock")
     
-    cart = await db.carts.find_one({"user_id": user.id})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    cart_obj = Cart(**cart)
-    
-    # Find and update the item
-    item_found = False
-    for item in cart_obj.items:
-        if item.product_id == product_id:
-            item.quantity = quantity
-            item_found = True
-            break
-    
-    if not item_found:
-        raise HTTPException(status_code=404, detail="Item not found in cart")
-    
-    # Recalculate total
-    cart_obj.total = sum(item.quantity * item.price for item in cart_obj.items)
-    
-    # Recalculate discount if promo code is applied
-    if cart_obj.promo_code:
-        promo = await db.promo_codes.find_one({"code": cart_obj.promo_code, "active": True})
-        if promo:
-            cart_obj.discount = cart_obj.total * (promo["discount_percentage"] / 100)
-        else:
-            cart_obj.discount = 0
-            cart_obj.promo_code = None
-    
-    await db.carts.update_one(
-        {"user_id": user.id},
-        {"$set": cart_obj.dict()}
+    cart = await db.carts.find_one_and_update(
+        {"user_id": user.id, "items.product_id": product_id},
+        set_quantity_pipeline(product_id, quantity),
+        projection=NO_ID,
+        return_document=ReturnDocument.AFTER
     )
+    if not cart:
+        await cart_not_found_or_item(user.id)
     
-    return {"message": "Cart quantity updated"}
+    return fast_json({"message": "Cart quantity updated", "cart": trusted(Cart, cart)})
 
 @api_router.post("/admin/promo-codes")
-async def create_promo_code(code: str, discount_percentage: float, admin: User = Depends(get_admin_user)):
+async def create_promo_code(code: str, discount_percentage: float, admin: CurrentUser = Depends(get_admin_user)):
     promo = PromoCode(code=code, discount_percentage=discount_percentage)
     await db.promo_codes.insert_one(promo.dict())
     return promo
 
 @api_router.get("/admin/promo-codes")
-async def get_promo_codes(admin: User = Depends(get_admin_user)):
-    promos = await db.promo_codes.find({}).to_list(1000)
-    return [PromoCode(**promo) for promo in promos]
+async def get_promo_codes(request: Request, admin: CurrentUser = Depends(get_admin_user)):
+    if wants_ndjson(request):
+        return stream_documents(db.promo_codes.find({}, NO_ID).batch_size(STREAM_BATCH_SIZE), lambda promo: trusted(PromoCode, promo))
+    
+    promos = await db.promo_codes.find({}, NO_ID).to_list(1000)
+    return fast_json([trusted(PromoCode, promo) for promo in promos])
 
 @api_router.put("/admin/promo-codes/{promo_id}")
-async def update_promo_code(promo_id: str, code: str, discount_percentage: float, admin: User = Depends(get_admin_user)):
-    result = await db.promo_codes.update_one(
+async def update_promo_code(promo_id: str, code: str, discount_percentage: float, admin: CurrentUser = Depends(get_admin_user)):
+    previous = await db.promo_codes.find_one_and_update(
         {"id": promo_id},
         {"$set": {"code": code, "discount_percentage": discount_percentage}}
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Promo code not found")
     
+    await sync_carts_with_promo(previous["code"], {**previous, "code": code, "discount_percentage": discount_percentage})
     return {"message": "Promo code updated successfully"}
 
 @api_router.delete("/admin/promo-codes/{promo_id}")
-async def delete_promo_code(promo_id: str, admin: User = Depends(get_admin_user)):
-    result = await db.promo_codes.delete_one({"id": promo_id})
-    if result.deleted_count == 0:
+async def delete_promo_code(promo_id: str, admin: CurrentUser = Depends(get_admin_user)):
+    promo = await db.promo_codes.find_one_and_delete({"id": promo_id})
+    if promo is None:
         raise HTTPException(status_code=404, detail="Promo code not found")
+    await sync_carts_with_promo(promo["code"], None)
     return {"message": "Promo code deleted successfully"}
 
 @api_router.put("/admin/promo-codes/{promo_id}/toggle")
-async def toggle_promo_code(promo_id: str, active: bool, admin: User = Depends(get_admin_user)):
-    result = await db.promo_codes.update_one(
+async def toggle_promo_code(promo_id: str, active: bool, admin: CurrentUser = Depends(get_admin_user)):
+    promo = await db.promo_codes.find_one_and_update(
         {"id": promo_id},
-        {"$set": {"active": active}}
+        {"$set": {"active": active}},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if promo is None:
         raise HTTPException(status_code=404, detail="Promo code not found")
     
+    if not active:
+        await sync_carts_with_promo(promo["code"], None)
     return {"message": f"Promo code {'activated' if active else 'deactivated'} successfully"}
 
 # Product Filters Management Endpoints
 @api_router.get("/admin/product-filters")
-async def get_product_filters(admin: User = Depends(get_admin_user)):
-    filters = await db.product_filters.find({}).to_list(1000)
-    return [ProductFilter(**filter_data) for filter_data in filters]
+async def get_product_filters(admin: CurrentUser = Depends(get_admin_user)):
+    filters = await db.product_filters.find({}, NO_ID).to_list(1000)
+    return fast_json([trusted(ProductFilter, filter_data) for filter_data in filters])
 
 @api_router.post("/admin/product-filters")
 async def create_product_filter(
@@ -614,7 +2429,7 @@ async def create_product_filter(
     type: str, 
     field: str,
     values: List[str] = [],
-    admin: User = Depends(get_admin_user)
+    admin: CurrentUser = Depends(get_admin_user)
 ):
     filter_data = ProductFilter(
         name=name,
@@ -623,6 +2438,8 @@ async def create_product_filter(
         values=values
     )
     await db.product_filters.insert_one(filter_data.dict())
+    active_filter_cache.invalidate()
+    await catalog_versions.bump("filters")
     return filter_data
 
 @api_router.put("/admin/product-filters/{filter_id}")
@@ -632,7 +2449,7 @@ async def update_product_filter(
     type: str, 
     field: str,
     values: List[str] = [],
-    admin: User = Depends(get_admin_user)
+    admin: CurrentUser = Depends(get_admin_user)
 ):
     result = await db.product_filters.update_one(
         {"id": filter_id},
@@ -644,25 +2461,31 @@ async def update_product_filter(
         }}
     )
     
+    active_filter_cache.invalidate()
+    await catalog_versions.bump("filters")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product filter not found")
     
     return {"message": "Product filter updated successfully"}
 
 @api_router.delete("/admin/product-filters/{filter_id}")
-async def delete_product_filter(filter_id: str, admin: User = Depends(get_admin_user)):
+async def delete_product_filter(filter_id: str, admin: CurrentUser = Depends(get_admin_user)):
     result = await db.product_filters.delete_one({"id": filter_id})
+    active_filter_cache.invalidate()
+    await catalog_versions.bump("filters")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product filter not found")
     return {"message": "Product filter deleted successfully"}
 
 @api_router.put("/admin/product-filters/{filter_id}/toggle")
-async def toggle_product_filter(filter_id: str, active: bool, admin: User = Depends(get_admin_user)):
+async def toggle_product_filter(filter_id: str, active: bool, admin: CurrentUser = Depends(get_admin_user)):
     result = await db.product_filters.update_one(
         {"id": filter_id},
         {"$set": {"active": active}}
     )
     
+    active_filter_cache.invalidate()
+    await catalog_versions.bump("filters")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product filter not found")
     
@@ -670,9 +2493,12 @@ async def toggle_product_filter(filter_id: str, active: bool, admin: User = Depe
 
 # Endpoint pour récupérer les filtres actifs pour la page produit
 @api_router.get("/product-filters")
-async def get_active_product_filters():
-    filters = await db.product_filters.find({"active": True}).to_list(1000)
-    return [ProductFilter(**filter_data) for filter_data in filters]
+async def get_active_product_filters(request: Request, response: Response):
+    etag = await catalog_etag(request, "filters")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    return fast_json(await active_filter_cache.get_filters(), response)
 
 @api_router.get("/configurator/categories")
 async def get_configurator_categories():
@@ -681,7 +2507,7 @@ async def get_configurator_categories():
     }
 
 @api_router.post("/configurator/validate")
-async def validate_configuration(components: Dict[str, str], user: User = Depends(get_current_user)):
+async def validate_configuration(components: Dict[str, str], user: CurrentUser = Depends(get_current_user)):
     compatible, issues = await validate_pc_configuration(components)
     
     # Calculate total price
@@ -698,7 +2524,7 @@ async def validate_configuration(components: Dict[str, str], user: User = Depend
     }
 
 @api_router.post("/configurator/save")
-async def save_configuration(name: str, components: Dict[str, str], user: User = Depends(get_current_user)):
+async def save_configuration(name: str, components: Dict[str, str], user: CurrentUser = Depends(get_current_user)):
     compatible, issues = await validate_pc_configuration(components)
     
     total_price = 0
@@ -720,13 +2546,17 @@ async def save_configuration(name: str, components: Dict[str, str], user: User =
     return config
 
 @api_router.get("/configurator/my-configs")
-async def get_my_configurations(user: User = Depends(get_current_user)):
-    configs = await db.pc_configurations.find({"user_id": user.id}).to_list(1000)
-    return [PCConfiguration(**config) for config in configs]
+async def get_my_configurations(request: Request, user: CurrentUser = Depends(get_current_user)):
+    if wants_ndjson(request):
+        configs = db.pc_configurations.find({"user_id": user.id}, NO_ID).batch_size(STREAM_BATCH_SIZE)
+        return stream_documents(configs, lambda config: trusted(PCConfiguration, config))
+    
+    configs = await db.pc_configurations.find({"user_id": user.id}, NO_ID).to_list(1000)
+    return fast_json([trusted(PCConfiguration, config) for config in configs])
 
 # === SERVICE CLIENT ENDPOINTS ===
 @api_router.post("/support/tickets")
-async def create_support_ticket(ticket_data: SupportTicketCreate, user: User = Depends(get_current_user)):
+async def create_support_ticket(ticket_data: SupportTicketCreate, user: CurrentUser = Depends(get_current_user)):
     ticket = SupportTicket(
         user_id=user.id,
         subject=ticket_data.subject,
@@ -739,25 +2569,29 @@ async def create_support_ticket(ticket_data: SupportTicketCreate, user: User = D
     return {"message": "Ticket créé avec succès", "ticket_id": ticket.id}
 
 @api_router.get("/support/tickets")
-async def get_my_tickets(user: User = Depends(get_current_user)):
-    tickets = await db.support_tickets.find({"user_id": user.id}).sort("created_at", -1).to_list(100)
-    return [SupportTicket(**ticket) for ticket in tickets]
+async def get_my_tickets(user: CurrentUser = Depends(get_current_user)):
+    tickets = await db.support_tickets.find({"user_id": user.id}, NO_ID).sort("created_at", -1).to_list(100)
+    return fast_json([trusted(SupportTicket, ticket) for ticket in tickets])
 
 @api_router.get("/support/tickets/{ticket_id}")
-async def get_ticket_details(ticket_id: str, user: User = Depends(get_current_user)):
-    ticket = await db.support_tickets.find_one({"id": ticket_id, "user_id": user.id})
+async def get_ticket_details(ticket_id: str, user: CurrentUser = Depends(get_current_user)):
+    ticket = await db.support_tickets.find_one({"id": ticket_id, "user_id": user.id}, NO_ID)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket non trouvé")
-    return SupportTicket(**ticket)
+    return fast_json(trusted(SupportTicket, ticket))
 
 # Admin endpoints for support tickets
 @api_router.get("/admin/support/tickets")
-async def get_all_tickets(admin_password: str):
+async def get_all_tickets(admin_password: str, request: Request):
     if admin_password != ADMIN_PASSWORD:
         raise HTTPException(status_code=401, detail="Mot de passe admin incorrect")
     
-    tickets = await db.support_tickets.find({}).sort("created_at", -1).to_list(1000)
-    return [SupportTicket(**ticket) for ticket in tickets]
+    if wants_ndjson(request):
+        tickets = db.support_tickets.find({}, NO_ID).sort("created_at", -1).batch_size(STREAM_BATCH_SIZE)
+        return stream_documents(tickets, lambda ticket: trusted(SupportTicket, ticket))
+    
+    tickets = await db.support_tickets.find({}, NO_ID).sort("created_at", -1).to_list(1000)
+    return fast_json([trusted(SupportTicket, ticket) for ticket in tickets])
 
 @api_router.put("/admin/support/tickets/{ticket_id}/respond")
 async def respond_to_ticket(ticket_id: str, response_data: SupportTicketResponse, admin_password: str):
@@ -807,7 +2641,7 @@ async def update_ticket_status(ticket_id: str, status: str, admin_password: str)
 
 # === PRODUCT REVIEWS ENDPOINTS ===
 @api_router.post("/reviews")
-async def create_review(review_data: ProductReviewCreate, user: User = Depends(get_current_user)):
+async def create_review(review_data: ProductReviewCreate, user: CurrentUser = Depends(get_current_user)):
     # Check if product exists
     product = await db.products.find_one({"id": review_data.product_id})
     if not product:
@@ -826,62 +2660,196 @@ async def create_review(review_data: ProductReviewCreate, user: User = Depends(g
         user_id=user.id,
         product_id=review_data.product_id,
         rating=review_data.rating,
-        comment=review_data.comment
+        comment=review_data.comment,
+        username=user.username
     )
     
-    await db.product_reviews.insert_one(review.dict())
+    try:
+        await db.product_reviews.insert_one(review.dict())
+    except DuplicateKeyError:
+        # Concurrent double submit: the unique (product_id, user_id) index rejected the second one
+        raise HTTPException(status_code=400, detail="Vous avez déjà noté ce produit")
+    await db.products.update_one({"id": review.product_id}, rating_aggregate_update(review.rating, 1))
+    await catalog_versions.bump("reviews", "products")
     return {"message": "Avis ajouté avec succès"}
 
+# Statistiques groupées pour plusieurs produits (une seule agrégation)
+@api_router.get("/reviews/stats")
+async def get_reviews_stats(request: Request, response: Response, product_ids: str = ""):
+    requested = list(dict.fromkeys(product_id for product_id in product_ids.split(",") if product_id))
+    if len(requested) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many ids (max {MAX_BATCH_IDS})")
+    
+    etag = await catalog_etag(request, "reviews")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+    
+    stats = await aggregate_review_stats(requested) if requested else {}
+    return {product_id: public_review_stats(stats.get(product_id) or empty_review_stats()) for product_id in requested}
+
+# Pagination des avis par curseur (keyset) sur la clé de tri complète, id en dernier
+REVIEW_SORTS = {
+    "newest": [("created_at", DESCENDING), ("id", DESCENDING)],
+    "highest": [("rating", DESCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+    "lowest": [("rating", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+}
+DEFAULT_REVIEW_PAGE_SIZE = 10
+MAX_REVIEW_PAGE_SIZE = 50
+LEGACY_REVIEW_LIMIT = 100
+
+def encode_review_cursor(sort: str, last_review: dict) -> str:
+    values = [last_review[field] for field, _ in REVIEW_SORTS[sort]]
+    values = [{"$date": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    payload = json.dumps({"s": sort, "v": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_review_cursor(cursor: str, sort: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        values = [
+            datetime.fromisoformat(value["$date"]) if isinstance(value, dict) and "$date" in value else value
+            for value in payload["v"]
+        ]
+        cursor_sort = payload["s"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort != sort or len(values) != len(REVIEW_SORTS[sort]):
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    return values
+
+def review_keyset_criteria(sort: str, values: list) -> dict:
+    # Strictly after the cursor in the compound ordering: equal on the leading keys, past it on the next one
+    keys = REVIEW_SORTS[sort]
+    clauses = []
+    for position, (field, direction) in enumerate(keys):
+        clause = {leading: values[index] for index, (leading, _) in enumerate(keys[:position])}
+        clause[field] = {"$lt" if direction == DESCENDING else "$gt": values[position]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
 @api_router.get("/reviews/{product_id}")
-async def get_product_reviews(product_id: str):
-    reviews = await db.product_reviews.find({"product_id": product_id}).sort("created_at", -1).to_list(100)
-    
-    # Get user information for each review
-    enriched_reviews = []
-    for review in reviews:
-        user = await db.users.find_one({"id": review["user_id"]})
-        review_data = ProductReview(**review).dict()
-        review_data["username"] = user["username"] if user else "Utilisateur supprimé"
-        enriched_reviews.append(review_data)
+async def get_product_reviews(
+    product_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    sort: str = "newest"
+):
+    if sort not in REVIEW_SORTS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort, expected one of {sorted(REVIEW_SORTS)}")
     
-    return enriched_reviews
-
-@api_router.get("/reviews/{product_id}/stats")
-async def get_product_review_stats(product_id: str):
-    reviews = await db.product_reviews.find({"product_id": product_id}).to_list(1000)
+    # Sans limit ni cursor: liste des 100 plus récents (comportement historique)
+    paginated = limit is not None or cursor is not None
+    page_size = min(max(limit or DEFAULT_REVIEW_PAGE_SIZE, 1), MAX_REVIEW_PAGE_SIZE) if paginated else LEGACY_REVIEW_LIMIT
     
-    if not reviews:
-        return {
-            "average_rating": 0,
-            "total_reviews": 0,
-            "rating_distribution": {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-        }
+    query = {"product_id": product_id}
+    if cursor:
+        query = {"$and": [query, review_keyset_criteria(sort, decode_review_cursor(cursor, sort))]}
     
-    total_rating = sum(review["rating"] for review in reviews)
-    average_rating = round(total_rating / len(reviews), 1)
+    # Fetch one extra review to know whether another page exists
+    reviews = await db.product_reviews.find(query, NO_ID).sort(REVIEW_SORTS[sort]).limit(page_size + 1).to_list(page_size + 1)
+    has_more = len(reviews) > page_size
+    reviews = reviews[:page_size]
     
-    rating_distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
+    # Usernames are snapshotted on new reviews; older ones are resolved in one batched lookup
+    usernames = await username_cache.resolve([review["user_id"] for review in reviews if not review.get("username")])
     for review in reviews:
-        rating_distribution[review["rating"]] += 1
+        if not review.get("username"):
+            review["username"] = usernames.get(review["user_id"], DELETED_USER_NAME)
+    
+    items = [trusted(ProductReview, review) for review in reviews]
+    if not paginated:
+        return fast_json(items)
+    return fast_json({
+        "items": items,
+        "next_cursor": encode_review_cursor(sort, reviews[-1]) if has_more else None,
+        "has_more": has_more,
+    })
+
+@api_router.get("/reviews/{product_id}/stats")
+async def get_product_review_stats(product_id: str, request: Request, response: Response):
+    etag = await catalog_etag(request, "reviews")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
     
-    return {
-        "average_rating": average_rating,
-        "total_reviews": len(reviews),
-        "rating_distribution": rating_distribution
-    }
+    stats = await aggregate_review_stats([product_id])
+    return public_review_stats(stats.get(product_id) or empty_review_stats())
 
 @api_router.delete("/reviews/{review_id}")
-async def delete_review(review_id: str, user: User = Depends(get_current_user)):
-    result = await db.product_reviews.delete_one({"id": review_id, "user_id": user.id})
+async def delete_review(review_id: str, user: CurrentUser = Depends(get_current_user)):
+    review = await db.product_reviews.find_one_and_delete({"id": review_id, "user_id": user.id})
     
-    if result.deleted_count == 0:
+    if review is None:
         raise HTTPException(status_code=404, detail="Avis non trouvé")
     
+    await db.products.update_one({"id": review["product_id"]}, rating_aggregate_update(review["rating"], -1))
+    await catalog_versions.bump("reviews", "products")
     return {"message": "Avis supprimé"}
 
+# === ADMIN MAINTENANCE ENDPOINTS ===
+@api_router.get("/admin/indexes")
+async def get_indexes(admin: CurrentUser = Depends(get_admin_user)):
+    existing = {}
+    for collection_name in INDEX_REGISTRY:
+        existing[collection_name] = sorted((await db[collection_name].index_information()).keys())
+    return {"bootstrap": index_bootstrap_report, "existing": existing}
+
+@api_router.get("/admin/cache/users")
+async def get_user_cache_stats(admin: CurrentUser = Depends(get_admin_user)):
+    return user_cache.stats()
+
+@api_router.delete("/admin/cache/users")
+async def clear_user_cache(admin: CurrentUser = Depends(get_admin_user)):
+    user_cache.clear()
+    return {"message": "User cache cleared"}
+
+@api_router.get("/admin/metrics/carts")
+async def get_cart_metrics(admin: CurrentUser = Depends(get_admin_user)):
+    return {
+        "carts": await db.carts.count_documents({}),
+        "empty_carts": await db.carts.count_documents({"items": {"$size": 0}}),
+        "retention_days": CART_RETENTION_DAYS,
+        "empty_retention_hours": EMPTY_CART_RETENTION_HOURS,
+        "purge_runs": cart_purge_stats.runs,
+        "purged_total": cart_purge_stats.purged_total,
+        "last_purged": cart_purge_stats.last_purged,
+        "last_run_at": cart_purge_stats.last_run_at,
+    }
+
+@api_router.post("/admin/carts/purge")
+async def purge_carts(admin: CurrentUser = Depends(get_admin_user)):
+    purged = await purge_expired_carts()
+    return {"purged": purged}
+
+@api_router.get("/admin/metrics/password-hashing")
+async def get_password_hashing_metrics(admin: CurrentUser = Depends(get_admin_user)):
+    return password_hasher.stats()
+
+@api_router.post("/admin/users/{user_id}/revoke-tokens")
+async def revoke_tokens(user_id: str, admin: CurrentUser = Depends(get_admin_user)):
+    token_version = await revoke_user_tokens(user_id)
+    if token_version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "Tokens revoked", "token_version": token_version}
+
+@api_router.post("/admin/products/recompute-ratings")
+async def recompute_ratings(admin: CurrentUser = Depends(get_admin_user)):
+    updated = await recompute_product_ratings()
+    await catalog_versions.bump("products")
+    return {"updated": updated}
+
+@api_router.post("/admin/indexes/ensure")
+async def rebuild_indexes(admin: CurrentUser = Depends(get_admin_user)):
+    report = await ensure_indexes()
+    return {"bootstrap": report}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(ImageUploadLimitMiddleware, max_bytes=MAX_IMAGE_REQUEST_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -897,13 +2865,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+search_refresh_task: Optional[asyncio.Task] = None
+token_revocation_task: Optional[asyncio.Task] = None
+cart_purge_task: Optional[asyncio.Task] = None
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if search_refresh_task is not None:
+        search_refresh_task.cancel()
+    if token_revocation_task is not None:
+        token_revocation_task.cancel()
+    if cart_purge_task is not None:
+        cart_purge_task.cancel()
     client.close()
+    if thumbnail_executor is not None:
+        thumbnail_executor.shutdown(wait=False, cancel_futures=True)
+    password_hasher.executor.shutdown(wait=False, cancel_futures=True)
 
 # Initialize some sample data
 @app.on_event("startup")
 async def startup_event():
+    await ensure_indexes()
+    
     # Create sample products if none exist
     product_count = await db.products.count_documents({})
     if product_count == 0:
@@ -963,4 +2946,27 @@ async def startup_event():
             }
         ]
         
-        await db.promo_codes.insert_many(sample_promos)
\ No newline at end of file
+        await db.promo_codes.insert_many(sample_promos)
+    
+    # Carts that got their promo before discount_percentage was stored on the cart
+    legacy_promo_codes = await db.carts.distinct("promo_code", {"promo_code": {"$ne": None}, "discount_percentage": {"$exists": False}})
+    for code in legacy_promo_codes:
+        await sync_carts_with_promo(code, await db.promo_codes.find_one({"code": code}))
+    
+    # Backfill rating aggregates on products created before they were denormalised
+    missing_ratings = await db.products.distinct("id", {"total_reviews": {"$exists": False}})
+    if missing_ratings:
+        await recompute_product_ratings(missing_ratings)
+        logger.info(f"Backfilled rating aggregates on {len(missing_ratings)} products")
+    
+    await rebuild_search_index()
+    global search_refresh_task
+    search_refresh_task = asyncio.create_task(refresh_search_index_periodically())
+    
+    await token_revocations.refresh()
+    global token_revocation_task
+    token_revocation_task = asyncio.create_task(refresh_token_revocations_periodically())
+    
+    await backfill_cart_expiry()
+    global cart_purge_task
+    cart_purge_task = asyncio.create_task(purge_expired_carts_periodically())
\ No newline at end of file
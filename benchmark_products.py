@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Serialization benchmark for GET /api/products
+Compares the original response path (Product(**doc) + FastAPI jsonable_encoder + json)
+with the trusted-document fast path (model_construct + orjson) on 1000 products.
+No database needed: the documents are generated in memory.
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from fastapi.encoders import jsonable_encoder
+import server
+
+PRODUCT_COUNT = 1000
+ROUNDS = 20
+
+def make_products(count):
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"AMD Ryzen {i % 9} {5000 + i}X",
+            "category": "CPU",
+            "brand": "AMD",
+            "price": 100 + i * 0.5,
+            "description": "12-core, 24-thread processor with exceptional gaming and content creation performance",
+            "image_base64": "",
+            "image_hash": None,
+            "image_url": None,
+            "stock_quantity": i % 20,
+            "stock_status": "in_stock",
+            "specifications": {"cores": 12, "threads": 24, "base_clock": "3.7 GHz", "boost_clock": "4.8 GHz", "socket": "AM4"},
+            "compatibility_requirements": {"socket": "AM4"},
+            "created_at": datetime.utcnow(),
+        }
+        for i in range(count)
+    ]
+
+def original_path(products):
+    # What get_products used to do: validate every document, then FastAPI encodes the models
+    models = [server.Product(**product) for product in products]
+    return json.dumps(jsonable_encoder(models)).encode()
+
+def fast_path(products):
+    return server.dump_json([server.shape_product(product, None) for product in products])
+
+def bench(name, function, products):
+    function(products)  # warm-up
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        body = function(products)
+    elapsed = (time.perf_counter() - start) / ROUNDS * 1000
+    print(f"{name:<16} {elapsed:8.2f} ms / response  ({len(body)} bytes)")
+    return elapsed, body
+
+if __name__ == "__main__":
+    products = make_products(PRODUCT_COUNT)
+    print(f"Serializing {PRODUCT_COUNT} products, {ROUNDS} rounds")
+    print("=" * 60)
+    original_ms, original_body = bench("original", original_path, products)
+    fast_ms, fast_body = bench("fast path", fast_path, products)
+    print("=" * 60)
+
+    same = json.loads(original_body) == json.loads(fast_body)
+    print(f"Identical JSON: {'✅' if same else '❌'}")
+    print(f"Speedup: {original_ms / fast_ms:.1f}x")
+    sys.exit(0 if same else 1)
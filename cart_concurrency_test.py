@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Cart concurrency stress test for INFOTECH.MA
+Fires many simultaneous cart mutations for the same user (as if from several open tabs)
+and checks that none of them is lost and that total/discount match the items.
+Run against a live backend, like backend_test.py.
+"""
+
+import requests
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Get backend URL from frontend .env file
+def get_backend_url():
+    try:
+        with open('/app/frontend/.env', 'r') as f:
+            for line in f:
+                if line.startswith('REACT_APP_BACKEND_URL='):
+                    base_url = line.split('=')[1].strip()
+                    return f"{base_url}/api"
+        return "http://localhost:8001/api"  # fallback
+    except:
+        return "http://localhost:8001/api"  # fallback
+
+BASE_URL = get_backend_url()
+print(f"Testing backend at: {BASE_URL}")
+
+CONCURRENT_REQUESTS = 50
+WORKERS = 16
+PROMO_CODE = "STRESS10"
+PROMO_PERCENTAGE = 10
+
+test_results = []
+
+def log_test(test_name, success, message=""):
+    """Log test results"""
+    status = "✅ PASS" if success else "❌ FAIL"
+    test_results.append(success)
+    print(f"{status}: {test_name}")
+    if message:
+        print(f"   {message}")
+    print()
+
+def register_user():
+    suffix = uuid.uuid4().hex[:8]
+    response = requests.post(f"{BASE_URL}/register", json={
+        "email": f"stress_{suffix}@infotech.ma",
+        "username": f"stress_{suffix}",
+        "password": "stresspass123"
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def admin_headers():
+    response = requests.post(f"{BASE_URL}/admin/login", json={"password": "NEW"})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def pick_products(count):
+    # Stock is checked per request, so any product with a few units left will do
+    products = requests.get(f"{BASE_URL}/products").json()
+    in_stock = [product for product in products if product["stock_quantity"] >= 3]
+    return in_stock[:count]
+
+def get_cart(headers):
+    return requests.get(f"{BASE_URL}/cart", headers=headers).json()
+
+def check_totals(cart):
+    expected_total = sum(item["quantity"] * item["price"] for item in cart["items"])
+    expected_discount = expected_total * cart.get("discount_percentage", 0) / 100
+    return abs(cart["total"] - expected_total) < 0.01 and abs(cart["discount"] - expected_discount) < 0.01
+
+def run_parallel(function, arguments):
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        return list(executor.map(function, arguments))
+
+def check_concurrent_adds_same_product(headers, product):
+    """N simultaneous +1 on the same product must end with quantity N"""
+    statuses = run_parallel(
+        lambda _: requests.post(f"{BASE_URL}/cart/add", params={"product_id": product["id"], "quantity": 1}, headers=headers).status_code,
+        range(CONCURRENT_REQUESTS)
+    )
+    cart = get_cart(headers)
+    quantity = next((item["quantity"] for item in cart["items"] if item["product_id"] == product["id"]), 0)
+    success = statuses.count(200) == CONCURRENT_REQUESTS and quantity == CONCURRENT_REQUESTS and check_totals(cart)
+    log_test("Concurrent adds on one product", success, f"{statuses.count(200)} OK, quantity {quantity}/{CONCURRENT_REQUESTS}, total {cart['total']}")
+    return success
+
+def check_concurrent_adds_distinct_products(headers, products):
+    """Simultaneous first adds of different products must all be kept (no array overwrite)"""
+    run_parallel(
+        lambda product: requests.post(f"{BASE_URL}/cart/add", params={"product_id": product["id"], "quantity": 2}, headers=headers),
+        products
+    )
+    cart = get_cart(headers)
+    quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+    success = all(quantities.get(product["id"], 0) >= 2 for product in products) and check_totals(cart)
+    log_test("Concurrent adds on distinct products", success, f"{len(cart['items'])} lines in cart, total {cart['total']}")
+    return success
+
+def check_mixed_mutations(headers, products, admin):
+    """Adds, quantity updates, removals and promo application racing each other keep totals consistent"""
+    requests.post(f"{BASE_URL}/admin/promo-codes", params={"code": PROMO_CODE, "discount_percentage": PROMO_PERCENTAGE}, headers=admin)
+    keep, churn = products[0], products[1]
+
+    def mutate(index):
+        if index % 4 == 0:
+            return requests.post(f"{BASE_URL}/cart/add", params={"product_id": churn["id"], "quantity": 1}, headers=headers)
+        if index % 4 == 1:
+            return requests.delete(f"{BASE_URL}/cart/remove/{churn['id']}", headers=headers)
+        if index % 4 == 2:
+            return requests.put(f"{BASE_URL}/cart/update/{keep['id']}", params={"quantity": 3}, headers=headers)
+        return requests.post(f"{BASE_URL}/cart/apply-promo", params={"code": PROMO_CODE}, headers=headers)
+
+    run_parallel(mutate, range(CONCURRENT_REQUESTS))
+    cart = get_cart(headers)
+    quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+    success = quantities.get(keep["id"]) == 3 and cart["promo_code"] == PROMO_CODE and check_totals(cart)
+    log_test("Mixed concurrent mutations", success, f"total {cart['total']}, discount {cart['discount']}, promo {cart['promo_code']}")
+    return success
+
+def run_all_tests():
+    products = pick_products(4)
+    if len(products) < 2:
+        print("Need at least 2 products in stock")
+        return False
+
+    results = [
+        check_concurrent_adds_same_product(register_user(), products[0]),
+        check_concurrent_adds_distinct_products(register_user(), products),
+    ]
+    headers = register_user()
+    requests.post(f"{BASE_URL}/cart/add", params={"product_id": products[0]["id"], "quantity": 1}, headers=headers)
+    results.append(check_mixed_mutations(headers, products, admin_headers()))
+
+    print("=" * 60)
+    print(f"{sum(results)}/{len(results)} cart concurrency tests passed")
+    return all(results)
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -5,6 +5,56 @@ import axios from "axios";
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'https://a9ce45b8-ba87-426a-abfa-3a78e2e1314c.preview.emergentagent.com';
 const API = `${BACKEND_URL}/api`;
 
+// Image du produit: miniature du stockage d'images (small/medium/large), ou ancien format base64 en ligne
+const productImageSrc = (product, size) => {
+  if (product.image_url) return `${BACKEND_URL}${product.image_url}${size ? `?size=${size}` : ''}`;
+  if (product.image_base64) return `data:image/jpeg;base64,${product.image_base64}`;
+  return null;
+};
+
+// Renouvellement transparent de la session: sur 401, échange du refresh token puis nouvelle tentative
+let refreshPromise = null;
+
+const retryWithToken = (original, accessToken) => {
+  axios.defaults.headers.common['Authorization'] = `Bearer ${accessToken}`;
+  original.headers = { ...original.headers, Authorization: `Bearer ${accessToken}` };
+  return axios(original);
+};
+
+axios.interceptors.response.use(
+  response => response,
+  async (error) => {
+    const original = error.config;
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!error.response || error.response.status !== 401 || !refreshToken || !original || original._retried
+        || original.url === `${API}/token/refresh`) {
+      return Promise.reject(error);
+    }
+    original._retried = true;
+    // Les onglets partagent localStorage: si un autre onglet a déjà renouvelé la session, réutiliser son jeton
+    const storedToken = localStorage.getItem('token');
+    if (storedToken && original.headers?.Authorization !== `Bearer ${storedToken}`) {
+      return retryWithToken(original, storedToken);
+    }
+    try {
+      // Une seule requête de renouvellement pour toutes les requêtes en échec simultanées
+      refreshPromise = refreshPromise || axios.post(`${API}/token/refresh`, { refresh_token: refreshToken })
+        .finally(() => { refreshPromise = null; });
+      const { data } = await refreshPromise;
+      localStorage.setItem('token', data.access_token);
+      localStorage.setItem('refresh_token', data.refresh_token);
+      return retryWithToken(original, data.access_token);
+    } catch (refreshError) {
+      // Un autre onglet a pu renouveler pendant ce temps: ne pas effacer ses jetons, les utiliser
+      if (localStorage.getItem('refresh_token') !== refreshToken) {
+        return retryWithToken(original, localStorage.getItem('token'));
+      }
+      localStorage.removeItem('refresh_token');
+      return Promise.reject(error);
+    }
+  }
+);
+
 // Auth Context
 const AuthContext = createContext();
 const CartContext = createContext();
@@ -24,15 +74,23 @@ const AuthProvider = ({ children }) => {
     }
   }, [token]);
 
-  const login = (tokenData, userData) => {
+  const login = (tokenData, userData, refreshToken) => {
     localStorage.setItem('token', tokenData);
     localStorage.setItem('user', JSON.stringify(userData));
+    if (refreshToken) {
+      localStorage.setItem('refresh_token', refreshToken);
+    }
     setToken(tokenData);
     setUser(userData);
     axios.defaults.headers.common['Authorization'] = `Bearer ${tokenData}`;
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (refreshToken) {
+      axios.post(`${API}/token/revoke`, { refresh_token: refreshToken }).catch(() => {});
+      localStorage.removeItem('refresh_token');
+    }
     localStorage.removeItem('token');
     localStorage.removeItem('user');
     setToken(null);
@@ -368,7 +426,7 @@ const Login = () => {
     e.preventDefault();
     try {
       const response = await axios.post(`${API}/login`, formData);
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       window.location.href = '/';
     } catch (error) {
       setError(error.response?.data?.detail || 'Erreur de connexion');
@@ -433,7 +491,7 @@ const Register = () => {
     e.preventDefault();
     try {
       const response = await axios.post(`${API}/register`, formData);
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       window.location.href = '/';
     } catch (error) {
       setError(error.response?.data?.detail || 'Erreur lors de l\'inscription');
@@ -508,7 +566,7 @@ const AdminLogin = () => {
     
     try {
       const response = await axios.post(`${API}/admin/login`, { password });
-      login(response.data.access_token, response.data.user);
+      login(response.data.access_token, response.data.user, response.data.refresh_token);
       window.location.href = '/admin';
     } catch (error) {
       setError('Mot de passe administrateur incorrect');
@@ -543,6 +601,7 @@ const AdminLogin = () => {
           
           if (response.ok) {
             localStorage.setItem('token', data.access_token);
+            localStorage.setItem('refresh_token', data.refresh_token);
             localStorage.setItem('user', JSON.stringify(data.user));
             window.location.href = '/admin';
           } else {
@@ -684,7 +743,8 @@ const Products = () => {
 
   const fetchProducts = async () => {
     try {
-      const params = new URLSearchParams();
+      // La grille n'affiche que les champs de la carte produit (pas de description ni de spécifications)
+      const params = new URLSearchParams({ fields: 'card' });
       if (category) params.append('category', category);
       if (searchQuery) params.append('search', searchQuery);
       
@@ -701,19 +761,14 @@ const Products = () => {
       const response = await axios.get(`${API}/products?${params}`);
       setProducts(response.data);
       
-      // Récupérer les statistiques des avis pour chaque produit
+      // Les statistiques des avis sont incluses dans chaque produit
       const reviewStats = {};
-      await Promise.all(
-        response.data.map(async (product) => {
-          try {
-            const statsResponse = await axios.get(`${API}/reviews/${product.id}/stats`);
-            reviewStats[product.id] = statsResponse.data;
-          } catch (error) {
-            console.error(`Erreur lors du chargement des stats pour ${product.id}:`, error);
-            reviewStats[product.id] = { average_rating: 0, total_reviews: 0 };
-          }
-        })
-      );
+      response.data.forEach(product => {
+        reviewStats[product.id] = {
+          average_rating: product.average_rating || 0,
+          total_reviews: product.total_reviews || 0
+        };
+      });
       setProductsReviewStats(reviewStats);
     } catch (error) {
       console.error('Erreur lors du chargement des produits:', error);
@@ -1078,9 +1133,9 @@ const Products = () => {
         {filteredProducts.map(product => (
           <div key={product.id} className="bg-white rounded-lg shadow-md overflow-hidden">
             <div className="h-48 bg-gray-200 flex items-center justify-center">
-              {product.image_base64 ? (
+              {productImageSrc(product) ? (
                 <img 
-                  src={`data:image/jpeg;base64,${product.image_base64}`} 
+                  src={productImageSrc(product, 'medium')} 
                   alt={product.name}
                   className="w-full h-full object-cover"
                 />
@@ -1178,12 +1233,17 @@ const Products = () => {
 };
 
 // Product Detail Component
+const REVIEWS_PAGE_SIZE = 10;
+
 const ProductDetail = ({ productId }) => {
   const { user } = useAuth();
   const { updateCartCount, triggerCartAnimation } = useCart();
   const [product, setProduct] = useState(null);
   const [loading, setLoading] = useState(true);
   const [reviews, setReviews] = useState([]);
+  const [reviewsCursor, setReviewsCursor] = useState(null);
+  const [reviewsSort, setReviewsSort] = useState('newest');
+  const [loadingMoreReviews, setLoadingMoreReviews] = useState(false);
   const [reviewStats, setReviewStats] = useState(null);
   const [showReviewForm, setShowReviewForm] = useState(false);
   const [reviewForm, setReviewForm] = useState({
@@ -1193,10 +1253,13 @@ const ProductDetail = ({ productId }) => {
 
   useEffect(() => {
     fetchProduct();
-    fetchReviews();
     fetchReviewStats();
   }, [productId]);
 
+  useEffect(() => {
+    fetchReviews();
+  }, [productId, reviewsSort]);
+
   const fetchProduct = async () => {
     try {
       const response = await axios.get(`${API}/products/${productId}`);
@@ -1208,12 +1271,32 @@ const ProductDetail = ({ productId }) => {
     }
   };
 
+  // Première page d'avis, les suivantes sont chargées à la demande
   const fetchReviews = async () => {
     try {
-      const response = await axios.get(`${API}/reviews/${productId}`);
-      setReviews(response.data);
+      const response = await axios.get(`${API}/reviews/${productId}`, {
+        params: { limit: REVIEWS_PAGE_SIZE, sort: reviewsSort }
+      });
+      setReviews(response.data.items);
+      setReviewsCursor(response.data.has_more ? response.data.next_cursor : null);
+    } catch (error) {
+      console.error('Erreur lors du chargement des avis:', error);
+    }
+  };
+
+  const fetchMoreReviews = async () => {
+    if (!reviewsCursor) return;
+    setLoadingMoreReviews(true);
+    try {
+      const response = await axios.get(`${API}/reviews/${productId}`, {
+        params: { limit: REVIEWS_PAGE_SIZE, sort: reviewsSort, cursor: reviewsCursor }
+      });
+      setReviews(previous => [...previous, ...response.data.items]);
+      setReviewsCursor(response.data.has_more ? response.data.next_cursor : null);
     } catch (error) {
       console.error('Erreur lors du chargement des avis:', error);
+    } finally {
+      setLoadingMoreReviews(false);
     }
   };
 
@@ -1357,9 +1440,9 @@ const ProductDetail = ({ productId }) => {
     <div className="container mx-auto px-4 py-8">
       <div className="grid md:grid-cols-2 gap-8 mb-8">
         <div className="bg-gray-200 h-96 rounded-lg flex items-center justify-center">
-          {product.image_base64 ? (
+          {productImageSrc(product) ? (
             <img 
-              src={`data:image/jpeg;base64,${product.image_base64}`} 
+              src={productImageSrc(product, 'large')} 
               alt={product.name}
               className="max-w-full max-h-full object-contain"
             />
@@ -1489,6 +1572,19 @@ const ProductDetail = ({ productId }) => {
         )}
 
         {/* Liste des avis */}
+        {reviews.length > 0 && (
+          <div className="flex justify-end mb-4">
+            <select
+              value={reviewsSort}
+              onChange={(e) => setReviewsSort(e.target.value)}
+              className="p-2 border rounded text-sm"
+            >
+              <option value="newest">Plus récents</option>
+              <option value="highest">Meilleures notes</option>
+              <option value="lowest">Notes les plus basses</option>
+            </select>
+          </div>
+        )}
         {reviews.length === 0 ? (
           <div className="text-center py-8 text-gray-500">
             Aucun avis pour ce produit. Soyez le premier à donner votre avis !
@@ -1513,6 +1609,17 @@ const ProductDetail = ({ productId }) => {
                 )}
               </div>
             ))}
+            {reviewsCursor && (
+              <div className="text-center">
+                <button
+                  onClick={fetchMoreReviews}
+                  disabled={loadingMoreReviews}
+                  className="px-6 py-2 border rounded hover:bg-gray-50 disabled:opacity-50"
+                >
+                  {loadingMoreReviews ? 'Chargement...' : 'Voir plus d\'avis'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
@@ -1784,34 +1891,22 @@ const Cart = () => {
     }
     
     try {
+      // Panier et fiches produits en une seule requête
       const response = await axios.get(`${API}/cart`, {
+        params: { expand: 'products' },
         headers: { Authorization: `Bearer ${token}` }
       });
       const cartData = response.data;
       setCart(cartData);
       
-      // Récupérer les détails des produits pour chaque item du panier
-      const itemsWithDetails = await Promise.all(
-        cartData.items.map(async (item) => {
-          try {
-            const productResponse = await axios.get(`${API}/products/${item.product_id}`);
-            return {
-              ...item,
-              product: productResponse.data
-            };
-          } catch (error) {
-            console.error(`Erreur lors du chargement du produit ${item.product_id}:`, error);
-            return {
-              ...item,
-              product: { 
-                name: 'Produit indisponible',
-                image_base64: '',
-                brand: 'Inconnu'
-              }
-            };
-          }
-        })
-      );
+      const itemsWithDetails = cartData.items.map(item => ({
+        ...item,
+        product: item.product || {
+          name: 'Produit indisponible',
+          image_base64: '',
+          brand: 'Inconnu'
+        }
+      }));
       
       setCartItemsWithDetails(itemsWithDetails);
     } catch (error) {
@@ -1886,9 +1981,9 @@ const Cart = () => {
                 <div key={index} className="p-6 border-b flex items-center space-x-4">
                   {/* Image du produit */}
                   <div className="w-20 h-20 bg-gray-200 rounded-lg flex-shrink-0">
-                    {item.product.image_base64 ? (
+                    {productImageSrc(item.product) ? (
                       <img 
-                        src={`data:image/jpeg;base64,${item.product.image_base64}`} 
+                        src={productImageSrc(item.product, 'small')} 
                         alt={item.product.name}
                         className="w-full h-full object-cover rounded-lg"
                       />
@@ -1904,6 +1999,9 @@ const Cart = () => {
                     <h3 className="font-semibold text-lg">{item.product.name}</h3>
                     <p className="text-gray-600">{item.product.brand}</p>
                     <p className="text-blue-600 font-semibold">{item.price} MAD</p>
+                    {item.price_changed && (
+                      <p className="text-orange-600 text-sm">Prix actuel: {item.current_price} MAD</p>
+                    )}
                   </div>
                   
                   {/* Contrôles de quantité */}
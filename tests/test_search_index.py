@@ -0,0 +1,139 @@
+"""
+Unit tests for the in-memory product search structures of backend/server.py
+(inverted index, trigram fuzzy fallback, search-as-you-type suggestions).
+No database needed: the indexes are fed plain product dicts.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test")
+
+import server
+
+ALL_FIELDS = list(server.SEARCH_FIELD_WEIGHTS)
+
+PRODUCTS = [
+    {"id": "cpu", "name": "AMD Ryzen 9 5900X", "brand": "AMD", "category": "Processeurs"},
+    {"id": "gpu", "name": "MSI GeForce RTX 4070 Ti", "brand": "MSI", "category": "Cartes graphiques"},
+    {"id": "ram", "name": "Corsair Vengeance 32GB DDR4", "brand": "Corsair", "category": "Mémoire"},
+    {"id": "case", "name": "Boitier Vengeance Noir", "brand": "Corsair", "category": "Boitiers"},
+]
+
+@pytest.fixture
+def engine():
+    engine = server.InvertedIndexSearchEngine()
+    engine.rebuild(PRODUCTS)
+    return engine
+
+@pytest.fixture
+def suggest_index():
+    index = server.SuggestIndex()
+    index.rebuild(PRODUCTS)
+    return index
+
+def test_search_engine_is_abstract():
+    with pytest.raises(TypeError):
+        server.ProductSearchEngine()
+
+def test_tokenize_strips_accents_and_punctuation():
+    assert server.tokenize("Mémoire DDR4-3200 (32 Go)") == ["memoire", "ddr4", "3200", "32", "go"]
+
+def test_search_matches_token_prefixes_in_every_field(engine):
+    assert engine.search("ryzen 5900", ALL_FIELDS) == ["cpu"]
+    assert engine.search("amd ry", ALL_FIELDS) == ["cpu"]
+    assert engine.search("memoire", ALL_FIELDS) == ["ram"]
+    assert engine.search("ryzen rtx", ALL_FIELDS) == []
+
+def test_search_does_not_match_inside_tokens(engine):
+    # Token-prefix semantics: unlike the former substring regex, "900x" does not find "5900X"
+    assert engine.search("900x", ALL_FIELDS) == []
+
+def test_search_restricted_to_fields(engine):
+    assert engine.search("corsair", ["name"]) == ["ram"]
+    assert engine.search("processeurs", ["name", "brand"]) == []
+
+def test_search_ranks_name_matches_before_brand_matches(engine):
+    # "ram" has Corsair in its name and brand, "case" only in its brand
+    assert engine.search("corsair", ALL_FIELDS) == ["ram", "case"]
+
+def test_search_ranks_exact_tokens_before_prefixes(engine):
+    engine.upsert({"id": "ssd", "name": "Corsair MP600", "brand": "Corsair", "category": "Stockage"})
+    engine.upsert({"id": "hub", "name": "Corsairs USB Hub", "brand": "Generic", "category": "Accessoires"})
+    ranked = engine.search("corsair", ["name"])
+    assert ranked.index("ssd") < ranked.index("hub")
+
+def test_search_breaks_ties_by_name(engine):
+    assert engine.search("vengeance", ALL_FIELDS) == ["case", "ram"]
+
+def test_search_limit(engine):
+    assert engine.search("corsair", ALL_FIELDS, limit=1) == ["ram"]
+
+def test_upsert_remove_and_reupsert(engine):
+    engine.upsert({"id": "psu", "name": "Seasonic Focus 750W", "brand": "Seasonic", "category": "Alimentations"})
+    assert engine.search("seasonic", ALL_FIELDS) == ["psu"]
+
+    engine.upsert({"id": "psu", "name": "Seasonic Prime 850W", "brand": "Seasonic", "category": "Alimentations"})
+    assert engine.search("focus", ALL_FIELDS) == []
+    assert engine.search("prime", ALL_FIELDS) == ["psu"]
+
+    engine.remove("psu")
+    assert engine.search("seasonic", ALL_FIELDS) == []
+    assert "seasonic" not in engine.sorted_tokens
+    assert engine.fuzzy_search("seasonic prime") == []
+    # Removing an unknown product is a no-op
+    engine.remove("psu")
+
+def test_rebuild_replaces_previous_products(engine):
+    engine.rebuild(PRODUCTS[:1])
+    assert engine.search("corsair", ALL_FIELDS) == []
+    assert engine.search("ryzen", ALL_FIELDS) == ["cpu"]
+
+def test_fuzzy_search_tolerates_typos_and_glued_tokens(engine):
+    assert engine.search("ryzn 5900", ALL_FIELDS) == []
+    assert engine.fuzzy_search("ryzn 5900") == ["cpu"]
+    assert engine.fuzzy_search("rtx4070ti") == ["gpu"]
+    assert engine.fuzzy_search("corsar") == ["ram"]
+
+def test_fuzzy_search_misses_transpositions(engine):
+    # A swapped pair breaks too many trigrams to reach FUZZY_MIN_SIMILARITY (0.45)
+    assert engine.fuzzy_search("corsiar") == []
+
+def test_trigram_index_scores_and_orders_results():
+    index = server.TrigramIndex()
+    for product in PRODUCTS:
+        index.upsert(product["id"], product["name"])
+
+    assert index.search("rtx4070ti") == [("gpu", 1.0, 0.333)]
+    # Same share of the query in both names, the shorter one is the tighter match
+    assert [product_id for product_id, _, _ in index.search("vengance")] == ["case", "ram"]
+    assert index.search("") == []
+
+    index.remove("gpu")
+    assert index.search("rtx4070ti") == []
+    assert not any("gpu" in posting for posting in index.postings.values())
+
+def test_suggest_matches_name_words_brand_and_category(suggest_index):
+    assert [s["id"] for s in suggest_index.suggest("ryz", 10)] == ["cpu"]
+    assert [s["id"] for s in suggest_index.suggest("amd ry", 10)] == ["cpu"]
+    assert [s["id"] for s in suggest_index.suggest("5900", 10)] == ["cpu"]
+    assert [s["id"] for s in suggest_index.suggest("carte", 10)] == ["gpu"]
+    assert suggest_index.suggest("   ", 10) == []
+
+def test_suggest_ranks_name_prefixes_first(suggest_index):
+    # "ram" starts with Corsair, "case" only has it as brand
+    assert [s["id"] for s in suggest_index.suggest("cors", 10)] == ["ram", "case"]
+    assert suggest_index.suggest("cors", 1) == [{"id": "ram", "name": "Corsair Vengeance 32GB DDR4", "category": "Mémoire"}]
+
+def test_suggest_upsert_remove_and_reupsert(suggest_index):
+    suggest_index.upsert({"id": "cpu", "name": "AMD Ryzen 7 7800X3D", "brand": "AMD", "category": "Processeurs"})
+    assert suggest_index.suggest("5900", 10) == []
+    assert [s["id"] for s in suggest_index.suggest("7800", 10)] == ["cpu"]
+
+    suggest_index.remove("cpu")
+    assert suggest_index.suggest("ryz", 10) == []
+    assert all(product_id != "cpu" for _, product_id in suggest_index.entries)